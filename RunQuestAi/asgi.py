@@ -3,6 +3,13 @@ ASGI config for RunQuestAi project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Requests to /runs/<id>/stream/ are served by app.streaming, which reads the
+upload incrementally, and /runs/<id>/live/ event streams by its LiveFeedApp;
+everything else goes to Django. Streaming uploads only
+stay cheap under an ASGI server, e.g. gunicorn with uvicorn workers:
+
+    gunicorn RunQuestAi.asgi:application -k uvicorn.workers.UvicornWorker
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -13,4 +20,8 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'RunQuestAi.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from app.streaming import LiveFeedApp, StreamingIngestApp  # noqa: E402  needs the app registry loaded
+
+application = StreamingIngestApp(LiveFeedApp(django_application))
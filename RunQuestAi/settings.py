@@ -2,6 +2,7 @@
 Django settings for RunQuestAi project.
 """
 import os
+import tempfile
 from pathlib import Path
 from datetime import timedelta
 from dotenv import load_dotenv
@@ -55,6 +56,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "app.middleware.PerformanceMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.security.SecurityMiddleware",
@@ -94,8 +96,38 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # Keep connections between requests instead of reopening the file every time
+        "CONN_MAX_AGE": 600,
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": {
+            # Take the write lock when a transaction starts, so concurrent writers queue
+            # on busy_timeout instead of failing when they upgrade from a read lock
+            "transaction_mode": "IMMEDIATE",
+            "timeout": 20,
+        },
     }
 }
+# WAL and other pragmas are set per connection in app.models.configure_sqlite
+SQLITE_BUSY_TIMEOUT_MS = 20000
+
+# ======================================
+# CACHE
+# ======================================
+# File based so every gunicorn worker on the instance shares cached reads and versions.
+# Once MAX_ENTRIES files are stored every write drops a third of them at random, version
+# keys included, so keep it above a profile per active user plus the /territories/ pages
+# and areas being read.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.getenv("CACHE_DIR", os.path.join(tempfile.gettempdir(), "runquest-cache")),
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.getenv("CACHE_MAX_ENTRIES", 20000)),
+        },
+    }
+}
+# Seconds a cached /territories/ or /profile/ response is kept
+API_CACHE_TIMEOUT = 300
 
 # ======================================
 # PASSWORDS
@@ -131,6 +163,19 @@ STATICFILES_DIRS = []
 
 STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 
+# Written by `manage.py build_schema` at build time. When it exists swagger/ and redoc/
+# load it as a static file instead of introspecting every view on each page load.
+OPENAPI_SCHEMA_FILE = STATIC_ROOT / "openapi.json"
+OPENAPI_SCHEMA_URL = STATIC_URL + "openapi.json" if OPENAPI_SCHEMA_FILE.exists() else None
+
+SWAGGER_SETTINGS = {
+    "DEFAULT_INFO": "app.urls.api_info",
+    "SPEC_URL": OPENAPI_SCHEMA_URL,
+}
+REDOC_SETTINGS = {
+    "SPEC_URL": OPENAPI_SCHEMA_URL,
+}
+
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
@@ -161,10 +206,12 @@ JWT_AUTH_COOKIE = "access_token"
 JWT_AUTH_REFRESH_COOKIE = "refresh_token"
 
 REST_FRAMEWORK = {
+    # Reads the token from the header or the cookie, users come from an in-process cache
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "dj_rest_auth.jwt_auth.JWTCookieAuthentication",
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "app.authentication.CachedJWTAuthentication",
     ),
+    "DEFAULT_PAGINATION_CLASS": "app.pagination.KeysetPagination",
+    "PAGE_SIZE": int(os.getenv("API_PAGE_SIZE", 50)),
 }
 
 SIMPLE_JWT = {
@@ -173,6 +220,10 @@ SIMPLE_JWT = {
     "SIGNING_KEY": SECRET_KEY,
 }
 
+# Authenticated users kept per process by app.authentication.CachedJWTAuthentication
+AUTH_USER_CACHE_SIZE = 1024
+AUTH_USER_CACHE_TTL = 300
+
 # ======================================
 # GOOGLE LOGIN
 # ======================================
@@ -184,3 +235,95 @@ SOCIALACCOUNT_PROVIDERS = {
         }
     }
 }
+
+# ======================================
+# RUN TRACKING
+# ======================================
+# Max GPS points accepted in one batch upload
+RUN_LOCATION_BATCH_MAX = int(os.getenv("RUN_LOCATION_BATCH_MAX", 5000))
+# add_location buffers points in process and writes them in batches (app.writer)
+LOCATION_WRITE_BEHIND = os.getenv("LOCATION_WRITE_BEHIND", "True") == "True"
+LOCATION_WRITER_FLUSH_POINTS = 200
+LOCATION_WRITER_FLUSH_SECONDS = 1
+# A run's buffered points are dropped (and logged) after this many failed writes
+LOCATION_WRITER_MAX_ATTEMPTS = 3
+# The finish job starts this many seconds after the request, so points buffered by other
+# workers are written before it reads the run; keep it above LOCATION_WRITER_FLUSH_SECONDS
+LOCATION_WRITER_FINISH_WAIT = LOCATION_WRITER_FLUSH_SECONDS + 0.5
+# Streaming uploads (/runs/<id>/stream/) are written every N points or N seconds
+STREAM_INGEST_FLUSH_POINTS = 500
+STREAM_INGEST_FLUSH_SECONDS = 5
+# Clean-up applied to a track before its distance and duration are measured at finish
+# (app.pipeline): (dotted path, options) stages run in order, [] measures the raw track
+TRACK_PIPELINE = [
+    ("app.pipeline.dedupe", {}),
+    ("app.pipeline.drop_speed_outliers", {"max_speed": 12.0}),
+    ("app.pipeline.smooth", {"window": 3}),
+    ("app.pipeline.drop_jitter", {"min_distance": 2.0}),
+]
+# Live tracking (app.live): points kept per run, runs tracked, and when an idle run is dropped
+LIVE_BUFFER_POINTS = 600
+LIVE_MAX_RUNS = 1000
+LIVE_IDLE_SECONDS = 900
+# /runs/<id>/live/ event streams check for new points every LIVE_POLL_SECONDS and are
+# closed after LIVE_STREAM_SECONDS; the client reconnects from its last cursor
+LIVE_POLL_SECONDS = 1
+LIVE_KEEPALIVE_SECONDS = 15
+LIVE_STREAM_SECONDS = 300
+# Runs are followed by their runner, others need a token from /runs/<id>/share_live/
+LIVE_SHARE_SECONDS = 6 * 3600
+# Runs older than this many days are packed into a RunTrack blob by compact_tracks
+TRACK_COMPACT_AFTER_DAYS = int(os.getenv("TRACK_COMPACT_AFTER_DAYS", 1))
+# Finished runs older than this many days are simplified by simplify_tracks, dropping
+# points closer than TRACK_SIMPLIFY_TOLERANCE meters to the simplified line
+TRACK_SIMPLIFY_AFTER_DAYS = int(os.getenv("TRACK_SIMPLIFY_AFTER_DAYS", 30))
+TRACK_SIMPLIFY_TOLERANCE = float(os.getenv("TRACK_SIMPLIFY_TOLERANCE", 3))
+
+# ======================================
+# TERRITORIES
+# ======================================
+# Default and max radius (meters) of /territories/?near=lat,lon&radius=
+TERRITORY_NEAR_RADIUS = 2000
+TERRITORY_NEAR_RADIUS_MAX = 50000
+# Radius (meters) of territories claimed by runs
+TERRITORY_RADIUS = 200
+# GPS fixes a run needs inside a territory to capture it
+TERRITORY_CAPTURE_MIN_POINTS = 10
+TERRITORY_MAX_CLAIMS_PER_RUN = 50
+
+# ======================================
+# HEATMAP
+# ======================================
+# Tile zoom levels the heatmap is aggregated at; other zooms are served from the nearest one
+HEATMAP_ZOOMS = (8, 11, 14)
+
+# ======================================
+# SYNC
+# ======================================
+# /sync/ tokens point this far back so changes committed late aren't missed
+SYNC_OVERLAP_SECONDS = 5
+# Rows per list in one /sync/ response; clients call again while has_more is true
+SYNC_PAGE_SIZE = int(os.getenv("SYNC_PAGE_SIZE", 500))
+
+# ======================================
+# BACKGROUND JOBS
+# ======================================
+# app.jobs runs queued jobs (e.g. run finishing) on JOB_WORKERS threads per process
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+JOB_POLL_SECONDS = 2
+JOB_MAX_ATTEMPTS = 3
+# Retries wait JOB_RETRY_DELAY seconds, doubling with every attempt
+JOB_RETRY_DELAY = 5
+# Jobs running longer than this are assumed lost with their process and queued again
+JOB_TIMEOUT_SECONDS = 600
+# Run jobs inside the request that enqueues them, without the background runner
+JOB_RUN_INLINE = os.getenv("JOB_RUN_INLINE", "False") == "True"
+
+# ======================================
+# PERFORMANCE METRICS
+# ======================================
+# Requests slower than this are logged with their SQL (0 disables the log)
+PERF_SLOW_REQUEST_MS = int(os.getenv("PERF_SLOW_REQUEST_MS", 0))
+# If set, /metrics/ requires "Authorization: Bearer <token>". Numbers are per gunicorn
+# worker (labelled worker="<pid>"), so each worker has to be scraped (app.metrics)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
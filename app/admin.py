@@ -1,9 +1,13 @@
 from django.contrib import admin
 
-from .models import Run,RunLocation,Territory,User
+from .models import HeatCell,Job,Run,RunLocation,RunTrack,Territory,Tombstone,User,UserStat
 
+admin.site.register(HeatCell)
+admin.site.register(Job)
 admin.site.register(Run)
 admin.site.register(RunLocation)
+admin.site.register(RunTrack)
 admin.site.register(Territory)
+admin.site.register(Tombstone)
 admin.site.register(User)
-
+admin.site.register(UserStat)
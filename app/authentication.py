@@ -0,0 +1,70 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from dj_rest_auth.jwt_auth import JWTCookieAuthentication
+from django.conf import settings
+from rest_framework_simplejwt.settings import api_settings
+
+from app import cache
+
+
+class UserCache:
+    """Bounded LRU of users with a TTL, shared by the threads of one process."""
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            user, expires = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return user
+
+    def set(self, key, user):
+        with self.lock:
+            self.entries[key] = (user, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+user_cache = UserCache(settings.AUTH_USER_CACHE_SIZE, settings.AUTH_USER_CACHE_TTL)
+
+
+class CachedJWTAuthentication(JWTCookieAuthentication):
+    """
+    JWT from the Authorization header or the access_token cookie, like
+    JWTCookieAuthentication, but the user is looked up in an in-process cache first.
+
+    Entries are keyed by user id and the user's cache version (app.cache), which
+    invalidate_user bumps whenever the user is saved: profile edits, password changes
+    and deactivation all make every worker load the user again.
+    """
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            return super().get_user(validated_token)
+
+        key = (user_id, cache.get_version(cache.user_namespace(user_id)))
+        user = user_cache.get(key)
+        if user is None:
+            user = super().get_user(validated_token)
+            user_cache.set(key, user)
+        # Views may change request.user, keep those changes out of the cached instance
+        return copy.copy(user)
@@ -0,0 +1,168 @@
+import math
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.tokens import AccessToken
+
+from app.models import Run, Territory, User
+from app.spatial import cell_for
+
+CITY_CENTER = (41.311, 69.279)
+CITY_RADIUS_DEG = 0.08
+RUN_SPEED = 3.0  # m/s
+
+
+def random_walk(rng, points, start=None, seconds=1.0):
+    # A jittery 1 Hz track at running pace, starting somewhere in the city
+    lat, lon = start or (
+        CITY_CENTER[0] + rng.uniform(-CITY_RADIUS_DEG, CITY_RADIUS_DEG),
+        CITY_CENTER[1] + rng.uniform(-CITY_RADIUS_DEG, CITY_RADIUS_DEG),
+    )
+    heading = rng.uniform(0, 2 * math.pi)
+    track = []
+    for _ in range(points):
+        heading += rng.gauss(0, 0.15)
+        step = RUN_SPEED * seconds / 111320
+        lat += step * math.cos(heading) + rng.gauss(0, 2e-6)
+        lon += step * math.sin(heading) / math.cos(math.radians(lat)) + rng.gauss(0, 2e-6)
+        track.append((lat, lon))
+    return track
+
+
+class Benchmark:
+    """
+    Drives the API hot paths through the Django test client on synthetic data and
+    records latency and query counts per endpoint. Expects to run against a scratch
+    database, see the `bench` management command.
+    """
+
+    def __init__(self, users=5, runs=3, points=3600, territories=2000, iterations=50, seed=0):
+        self.users = users
+        self.runs = runs
+        self.points = points
+        self.territories = territories
+        self.iterations = iterations
+        self.rng = random.Random(seed)
+        self.results = {}
+
+    def setup(self):
+        self.today = datetime.now(timezone.utc).date()
+        # Batch uploads carry client timestamps after the single-point phase, which uses server time
+        self.batch_start = datetime.now(timezone.utc) + timedelta(hours=1)
+        self.clients = []
+        for i in range(self.users):
+            user = User.objects.create_user(f'bench{i}', password='bench', weight=self.rng.randint(55, 95))
+            client = Client(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+
+            for day in range(1, self.runs + 1):
+                self.add_run(user, day)
+
+            today_run = client.post('/runs/').json()['id']
+            self.clients.append({
+                'user': user, 'client': client, 'run': today_run, 'days': self.runs, 'clock': 0, 'position': None,
+            })
+
+        owners = User.objects.filter(username__startswith='bench')
+        Territory.objects.bulk_create([
+            Territory(
+                owner=self.rng.choice(owners),
+                center_lat=lat, center_lon=lon, cell=cell_for(lat, lon),
+            )
+            for lat, lon in (
+                (CITY_CENTER[0] + self.rng.uniform(-CITY_RADIUS_DEG, CITY_RADIUS_DEG),
+                 CITY_CENTER[1] + self.rng.uniform(-CITY_RADIUS_DEG, CITY_RADIUS_DEG))
+                for _ in range(self.territories)
+            )
+        ], batch_size=500)
+
+    def add_run(self, user, day):
+        # A run of `points` points `day` days ago
+        run = Run.objects.create(user=user, date=self.today - timedelta(days=day))
+        start = datetime.combine(run.date, datetime.min.time(), timezone.utc) + timedelta(hours=7)
+        run.add_points([
+            {'lat': lat, 'lon': lon, 'ts': start + timedelta(seconds=s)}
+            for s, (lat, lon) in enumerate(random_walk(self.rng, self.points))
+        ])
+        return run
+
+    def next_points(self, user, count):
+        track = random_walk(self.rng, count, start=user['position'])
+        user['position'] = track[-1]
+        points = []
+        for lat, lon in track:
+            user['clock'] += 1
+            ts = self.batch_start + timedelta(seconds=user['clock'])
+            points.append({'lat': lat, 'lon': lon, 'ts': ts.isoformat()})
+        return points
+
+    def measure(self, name, request, prepare=None):
+        # prepare(user, i) sets up the data of a request outside the timing
+        timings, queries = [], []
+        for i in range(self.iterations):
+            user = self.clients[i % len(self.clients)]
+            if prepare is not None:
+                prepare(user, i)
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = request(user, i)
+                timings.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{name} returned {response.status_code}: {response.content[:200]!r}")
+            queries.append(len(captured))
+
+        timings = np.array(timings) * 1000
+        self.results[name] = {
+            'requests': len(timings),
+            'throughput_rps': round(len(timings) / (timings.sum() / 1000), 1),
+            'mean_ms': round(float(timings.mean()), 2),
+            'p50_ms': round(float(np.percentile(timings, 50)), 2),
+            'p95_ms': round(float(np.percentile(timings, 95)), 2),
+            'p99_ms': round(float(np.percentile(timings, 99)), 2),
+            'queries_mean': round(float(np.mean(queries)), 1),
+            'queries_max': int(max(queries)),
+        }
+
+    def run(self):
+        def add_location(user, i):
+            point = self.next_points(user, 1)[0]
+            return user['client'].post(f"/runs/{user['run']}/add_location/", {'lat': point['lat'], 'lon': point['lon']})
+
+        def add_locations(user, i):
+            points = self.next_points(user, 60)
+            return user['client'].post(f"/runs/{user['run']}/add_locations/", points, content_type='application/json')
+
+        def new_run(user, i):
+            # Every finish gets a run of its own, as a runner finishing the day's run
+            user['days'] += 1
+            user['finishing'] = self.add_run(user['user'], user['days']).id
+
+        def finish(user, i):
+            return user['client'].post(f"/runs/{user['finishing']}/finish/")
+
+        lat, lon = CITY_CENTER
+        self.measure('POST /runs/{id}/add_location/', add_location)
+        self.measure('POST /runs/{id}/add_locations/ (60 points)', add_locations)
+        # Inline, so the post-processing job is timed rather than the enqueue
+        with override_settings(JOB_RUN_INLINE=True):
+            self.measure('POST /runs/{id}/finish/ (job inline)', finish, prepare=new_run)
+        self.measure('GET /runs/', lambda user, i: user['client'].get('/runs/'))
+        self.measure('GET /territories/', lambda user, i: user['client'].get('/territories/'))
+        self.measure('GET /territories/?near=', lambda user, i: user['client'].get(
+            f'/territories/?near={lat},{lon}&radius=3000'))
+        return self.results
+
+    @property
+    def meta(self):
+        return {
+            'users': self.users,
+            'runs_per_user': self.runs,
+            'points_per_run': self.points,
+            'territories': self.territories,
+            'iterations': self.iterations,
+            'database': connection.vendor,
+        }
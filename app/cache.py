@@ -0,0 +1,45 @@
+import hashlib
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+TERRITORIES = 'territories'
+
+
+def user_namespace(user_id):
+    return f'user:{user_id}'
+
+
+# Each namespace has a random version token in the cache. Cached responses and ETags are
+# keyed by it, so invalidating is a single write and stale entries just expire.
+def get_version(namespace):
+    return cache.get_or_set(f'version:{namespace}', lambda: uuid4().hex[:12], None)
+
+
+def bump_version(namespace):
+    # After commit, so a concurrent read can't cache pre-commit rows under the new version
+    transaction.on_commit(lambda: cache.set(f'version:{namespace}', uuid4().hex[:12], None))
+
+
+def cached_response(request, namespace, build):
+    version = get_version(namespace)
+    digest = hashlib.md5(f'{version}:{request.build_absolute_uri()}'.encode()).hexdigest()
+    etag = f'"{digest}"'
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+
+    if etag in request.headers.get('If-None-Match', ''):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    key = f'response:{namespace}:{digest}'
+    data = cache.get(key)
+    if data is None:
+        response = build()
+        if response.status_code != status.HTTP_200_OK:
+            return response
+        data = response.data
+        cache.set(key, data, settings.API_CACHE_TIMEOUT)
+    return Response(data, headers=headers)
@@ -0,0 +1,112 @@
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from app import cache, geo, spatial
+from app.models import Territory
+
+# SQLite caps the number of bound parameters per query
+CELL_QUERY_CHUNK = 500
+
+
+def capture_territories(run):
+    """
+    Match a finished run against the territory map.
+
+    Route points are bucketed by grid cell, and each territory is only compared with the
+    points in the cells around its own, so the work grows with the size of the route's
+    neighbourhood rather than with points x territories. Territories the runner spends
+    at least TERRITORY_CAPTURE_MIN_POINTS fixes inside are captured (or held, if already
+    theirs); stretches of the route that no territory covers become new claims. Run.territory
+    is set to the territory the run spent most time in.
+    """
+    lats, lons, _ = run.track_points()
+    if len(lats) < 2:
+        return None
+
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    radius = settings.TERRITORY_RADIUS
+    min_points = settings.TERRITORY_CAPTURE_MIN_POINTS
+
+    # Point indices per grid cell
+    point_cells = spatial.cell_array(lats, lons)
+    order = np.argsort(point_cells, kind='stable')
+    cells, starts = np.unique(point_cells[order], return_index=True)
+    by_cell = dict(zip(cells.tolist(), np.split(order, starts[1:])))
+
+    pad = spatial.cell_pad(float(np.abs(lats).max()), 2 * radius)
+    search = sorted({n for cell in by_cell for n in spatial.neighbor_cells(cell, *pad)})
+
+    with transaction.atomic():
+        candidates = []
+        for i in range(0, len(search), CELL_QUERY_CHUNK):
+            candidates += Territory.objects.select_for_update().filter(cell__in=search[i:i + CELL_QUERY_CHUNK])
+
+        # A point within (territory radius + claim radius) of a territory can't start a new claim
+        covered = np.zeros(len(lats), dtype=bool)
+        visits = {}
+        for territory in candidates:
+            nearby = [by_cell[c] for c in spatial.neighbor_cells(territory.cell, *pad) if c in by_cell]
+            if not nearby:
+                continue
+            idx = np.concatenate(nearby)
+            dist = geo.haversine_array(territory.center_lat, territory.center_lon, lats[idx], lons[idx])
+            covered[idx[dist < territory.radius + radius]] = True
+            inside = int((dist <= territory.radius).sum())
+            if inside >= min_points:
+                visits[territory] = inside
+
+        captured = [t for t in visits if t.owner_id != run.user_id]
+        now = timezone.now()
+        for territory in captured:
+            territory.owner_id = run.user_id
+            territory.updated_at = now
+        Territory.objects.bulk_update(captured, ['owner', 'updated_at'])
+
+        claims = _claim(run, lats, lons, covered, radius, min_points)
+        Territory.objects.bulk_create(claims)
+        for territory in claims:
+            dist = geo.haversine_array(territory.center_lat, territory.center_lon, lats, lons)
+            visits[territory] = int((dist <= radius).sum())
+
+        if visits:
+            run.territory = max(visits, key=visits.get)
+            run.save(update_fields=['territory'])
+
+        if captured or claims:
+            # bulk_update/bulk_create don't send the signals that normally invalidate the map
+            cache.bump_version(cache.TERRITORIES)
+
+    return {
+        'territory': run.territory_id,
+        'captured': [t.id for t in captured],
+        'held': [t.id for t in visits if t not in captured and t not in claims],
+        'claimed': [t.id for t in claims],
+    }
+
+
+def _claim(run, lats, lons, covered, radius, min_points):
+    # Walk the uncovered part of the route and drop a new territory whenever the runner
+    # is at least two radii away from every territory placed so far
+    claims = []
+    centers = np.empty((0, 2))
+    for i in np.flatnonzero(~covered):
+        if len(claims) >= settings.TERRITORY_MAX_CLAIMS_PER_RUN:
+            break
+        if len(centers) and geo.haversine_array(lats[i], lons[i], centers[:, 0], centers[:, 1]).min() < 2 * radius:
+            continue
+        # Skip stray fixes, the runner has to stay in the area for min_points fixes
+        j = i + min_points - 1
+        if j >= len(lats) or geo.haversine(lats[i], lons[i], lats[j], lons[j]) > radius:
+            continue
+        claims.append(Territory(
+            owner_id=run.user_id,
+            center_lat=float(lats[i]),
+            center_lon=float(lons[i]),
+            radius=radius,
+            cell=spatial.cell_for(lats[i], lons[i]),
+        ))
+        centers = np.vstack([centers, (lats[i], lons[i])])
+    return claims
@@ -0,0 +1,95 @@
+import csv
+import json
+from xml.sax.saxutils import escape
+
+from django.http import StreamingHttpResponse
+from rest_framework.negotiation import DefaultContentNegotiation
+
+FORMATS = {
+    'gpx': 'application/gpx+xml',
+    'geojson': 'application/geo+json',
+    'csv': 'text/csv',
+}
+CHUNK_BYTES = 64 * 1024
+QUERY_CHUNK = 2000
+
+
+class ExportNegotiation(DefaultContentNegotiation):
+    # The format comes from the URL and the export bypasses the renderers, so an Accept of
+    # text/csv or application/gpx+xml mustn't end in a 406; errors still render as JSON
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+def iter_points(run):
+    return run.iter_track(chunk_size=QUERY_CHUNK)
+
+
+def _time(ts):
+    return ts.isoformat().replace('+00:00', 'Z')
+
+
+def gpx(runs):
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield '<gpx version="1.1" creator="RunQuest" xmlns="http://www.topografix.com/GPX/1/1">\n'
+    for run in runs:
+        yield f'<trk><name>{escape(str(run.date))}</name><type>running</type><trkseg>\n'
+        for lat, lon, ts in iter_points(run):
+            yield f'<trkpt lat="{lat}" lon="{lon}"><time>{_time(ts)}</time></trkpt>\n'
+        yield '</trkseg></trk>\n'
+    yield '</gpx>\n'
+
+
+def geojson(runs):
+    # One LineString feature per run with the point times in a "coordTimes" property.
+    # Coordinates and times are written in two passes over the track to keep memory flat.
+    yield '{"type":"FeatureCollection","features":['
+    for i, run in enumerate(runs):
+        yield (',' if i else '') + '{"type":"Feature","geometry":{"type":"LineString","coordinates":['
+        for j, (lat, lon, ts) in enumerate(iter_points(run)):
+            yield f'{"," if j else ""}[{lon},{lat}]'
+
+        properties = json.dumps({
+            'run': run.id,
+            'date': str(run.date),
+            'distance': run.distance,
+            'duration': run.duration,
+            'calories': run.calories,
+        })
+        yield ']},"properties":' + properties[:-1] + ',"coordTimes":['
+        for j, (lat, lon, ts) in enumerate(iter_points(run)):
+            yield f'{"," if j else ""}"{_time(ts)}"'
+        yield ']}}'
+    yield ']}\n'
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def csv_rows(runs):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(['run', 'date', 'timestamp', 'lat', 'lon'])
+    for run in runs:
+        for lat, lon, ts in iter_points(run):
+            yield writer.writerow([run.id, run.date, _time(ts), lat, lon])
+
+
+def buffered(parts):
+    buffer, size = [], 0
+    for part in parts:
+        buffer.append(part)
+        size += len(part)
+        if size >= CHUNK_BYTES:
+            yield ''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def export_response(runs, fmt, filename):
+    writer = {'gpx': gpx, 'geojson': geojson, 'csv': csv_rows}[fmt]
+    response = StreamingHttpResponse(buffered(writer(runs)), content_type=FORMATS[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+    return response
@@ -0,0 +1,103 @@
+import math
+
+import numpy as np
+
+EARTH_RADIUS = 6371000  # meters
+
+
+# Haversine distance in meters between two points
+def haversine(lat1, lon1, lat2, lon2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = math.radians(lat2 - lat1)
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return EARTH_RADIUS * (2 * math.atan2(math.sqrt(a), math.sqrt(1 - a)))
+
+
+def haversine_array(lat1, lon1, lat2, lon2):
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = np.radians(np.asarray(lon2, dtype=float) - lon1)
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return EARTH_RADIUS * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def segment_distances(lats, lons):
+    """Distance in meters between each pair of consecutive points (n - 1 values)."""
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    return haversine_array(lats[:-1], lons[:-1], lats[1:], lons[1:])
+
+
+def cumulative_distance(lats, lons):
+    """Distance covered up to each point, starting at 0 (n values)."""
+    return np.concatenate(([0.0], np.cumsum(segment_distances(lats, lons))))
+
+
+def track_distance(lats, lons):
+    if len(lats) < 2:
+        return 0.0
+    return float(segment_distances(lats, lons).sum())
+
+
+def speeds(lats, lons, seconds):
+    """Speed in m/s over each segment; segments with no elapsed time get 0."""
+    dist = segment_distances(lats, lons)
+    dt = np.diff(np.asarray(seconds, dtype=float))
+    return np.divide(dist, dt, out=np.zeros_like(dist), where=dt > 0)
+
+
+def bearings(lats, lons):
+    """Initial bearing of each segment in degrees, 0 = north, clockwise."""
+    phi = np.radians(np.asarray(lats, dtype=float))
+    lam = np.radians(np.asarray(lons, dtype=float))
+    phi1, phi2 = phi[:-1], phi[1:]
+    dlambda = lam[1:] - lam[:-1]
+    y = np.sin(dlambda) * np.cos(phi2)
+    x = np.cos(phi1) * np.sin(phi2) - np.sin(phi1) * np.cos(phi2) * np.cos(dlambda)
+    return (np.degrees(np.arctan2(y, x)) + 360) % 360
+
+
+def to_seconds(timestamps):
+    return np.fromiter((ts.timestamp() for ts in timestamps), dtype=float, count=len(timestamps))
+
+
+def simplify(lats, lons, tolerance):
+    """
+    Douglas–Peucker: indices of the points to keep so that no dropped point is more
+    than `tolerance` meters off the simplified line. The first and last points are
+    always kept.
+    """
+    n = len(lats)
+    if n < 3:
+        return np.arange(n)
+
+    # Local equirectangular projection, accurate enough at the scale of one run
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    scale = np.radians(1) * EARTH_RADIUS
+    x = (lons - lons[0]) * scale * math.cos(math.radians(lats.mean()))
+    y = (lats - lats[0]) * scale
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        px, py = x[start + 1:end] - x[start], y[start + 1:end] - y[start]
+        length = math.hypot(dx, dy)
+        if length:
+            offsets = np.abs(px * dy - py * dx) / length
+        else:
+            # Closed loop segment: distance from the shared end point
+            offsets = np.hypot(px, py)
+        i = int(offsets.argmax())
+        if offsets[i] > tolerance:
+            split = start + 1 + i
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return np.flatnonzero(keep)
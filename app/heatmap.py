@@ -0,0 +1,140 @@
+import math
+from collections import Counter
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from app.models import HeatCell, Run
+from app.track import unpack_track
+
+# Each stored tile is split into BINS x BINS cells; cell = row * BINS + col, row 0 at the top
+BINS = 64
+BIN_BITS = 6
+MAX_LAT = 85.05112878
+# How far below the lowest stored zoom a tile may be requested (4 ** 3 tiles read at most)
+MAX_ZOOM_OUT = 3
+
+
+def mercator_bins(lats, lons, zoom):
+    """Global web mercator bin (x, y) of each point at `zoom`, BINS bins per tile."""
+    lat = np.radians(np.clip(np.asarray(lats, dtype=float), -MAX_LAT, MAX_LAT))
+    size = 2 ** zoom * BINS
+    x = (np.asarray(lons, dtype=float) + 180) / 360 * size
+    y = (1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / math.pi) / 2 * size
+    return np.clip(x, 0, size - 1).astype(np.int64), np.clip(y, 0, size - 1).astype(np.int64)
+
+
+def cell_counts(lats, lons):
+    counts = Counter()
+    for zoom in settings.HEATMAP_ZOOMS:
+        x, y = mercator_bins(lats, lons, zoom)
+        keys, n = np.unique(np.stack([x, y]), axis=1, return_counts=True)
+        for (bx, by), count in zip(keys.T.tolist(), n.tolist()):
+            cell = (by & (BINS - 1)) * BINS + (bx & (BINS - 1))
+            counts[(zoom, bx >> BIN_BITS, by >> BIN_BITS, cell)] += count
+    return counts
+
+
+def new_points(run):
+    # Points recorded after the run was last counted, so finishing a run again doesn't double it
+    if run.track_packed:
+        lats, lons, timestamps = unpack_track(run.track.data)
+        points = [(lat, lon, ts) for lat, lon, ts in zip(lats, lons, timestamps)
+                  if run.heatmap_until is None or ts > run.heatmap_until]
+    else:
+        rows = run.locations.order_by('timestamp')
+        if run.heatmap_until:
+            rows = rows.filter(timestamp__gt=run.heatmap_until)
+        points = list(rows.values_list('lat', 'lon', 'timestamp'))
+    if not points:
+        return [], [], None
+    lats, lons, timestamps = zip(*points)
+    return lats, lons, timestamps[-1]
+
+
+def _add(counts, user_id):
+    tiles = Q()
+    for zoom, tile_x, tile_y in {key[:3] for key in counts}:
+        tiles |= Q(zoom=zoom, tile_x=tile_x, tile_y=tile_y)
+    owner = Q(user_id=user_id) if user_id else Q(user__isnull=True)
+
+    existing = {
+        (cell.zoom, cell.tile_x, cell.tile_y, cell.cell): cell
+        for cell in HeatCell.objects.select_for_update().filter(owner & tiles)
+    }
+    created = []
+    for key, count in counts.items():
+        if key in existing:
+            existing[key].count += count
+        else:
+            zoom, tile_x, tile_y, cell = key
+            created.append(HeatCell(user_id=user_id, zoom=zoom, tile_x=tile_x, tile_y=tile_y, cell=cell, count=count))
+    HeatCell.objects.bulk_update(existing.values(), ['count'], batch_size=500)
+    HeatCell.objects.bulk_create(created, batch_size=500)
+
+
+def record_heat(run):
+    """Add the run's not yet counted points to the global and the runner's heatmap cells."""
+    with transaction.atomic():
+        lats, lons, last = new_points(run)
+        if last is None:
+            return 0
+        counts = cell_counts(lats, lons)
+        _add(counts, None)
+        _add(counts, run.user_id)
+        run.heatmap_until = last
+        Run.objects.filter(pk=run.pk).update(heatmap_until=last)
+    return len(lats)
+
+
+def tile(z, x, y, user_id=None):
+    """
+    Heat of tile z/x/y as {'size', 'cells', 'counts'}: `cells` are indexes into a size x size
+    grid (row * size + col, row 0 at the top) and `counts` their point counts; empty cells
+    are left out. Only the stored tiles covering z/x/y are read.
+    """
+    zooms = sorted(settings.HEATMAP_ZOOMS)
+    level = next((zoom for zoom in zooms if zoom >= z), zooms[-1])
+    if level - z > MAX_ZOOM_OUT:
+        raise ValueError(f"Zoom must be at least {zooms[0] - MAX_ZOOM_OUT}")
+
+    cells = HeatCell.objects.filter(Q(user_id=user_id) if user_id else Q(user__isnull=True), zoom=level)
+    if level >= z:
+        # Several stored tiles, BINS >> shift cells each
+        shift = level - z
+        span = 1 << shift
+        cells = cells.filter(tile_x__range=(x * span, x * span + span - 1),
+                             tile_y__range=(y * span, y * span + span - 1))
+        size = BINS
+        origin_x, origin_y = x * span * BINS, y * span * BINS
+    else:
+        # Part of one stored tile
+        shift = 0
+        span = 1 << (z - level)
+        if span > BINS:
+            raise ValueError(f"Zoom must be at most {level + BIN_BITS}")
+        cells = cells.filter(tile_x=x // span, tile_y=y // span)
+        size = BINS // span
+        origin_x, origin_y = x * size, y * size
+
+    heat = Counter()
+    for tile_x, tile_y, cell, count in cells.values_list('tile_x', 'tile_y', 'cell', 'count'):
+        row, col = divmod(cell, BINS)
+        # Offset from the requested tile's corner, in bins of the stored zoom
+        bin_x = tile_x * BINS + col - origin_x
+        bin_y = tile_y * BINS + row - origin_y
+        if 0 <= bin_x < size << shift and 0 <= bin_y < size << shift:
+            heat[(bin_y >> shift) * size + (bin_x >> shift)] += count
+
+    keys = sorted(heat)
+    return {'size': size, 'cells': keys, 'counts': [heat[key] for key in keys]}
+
+
+def rebuild_heatmap():
+    with transaction.atomic():
+        HeatCell.objects.all().delete()
+        Run.objects.update(heatmap_until=None)
+    runs = Run.objects.filter(finished_at__isnull=False).select_related('track').order_by('id')
+    return sum(record_heat(run) for run in runs.iterator(chunk_size=100))
@@ -0,0 +1,152 @@
+import gzip
+import zipfile
+from datetime import timezone as dt_timezone
+from xml.etree.ElementTree import ParseError, iterparse
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from app.heatmap import record_heat
+from app.models import Run, calc_calories
+from app.pipeline import measure
+from app.stats import record_run
+
+IMPORT_BATCH = 2000
+TRACK_SUFFIXES = ('.gpx', '.tcx', '.gpx.gz', '.tcx.gz')
+
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _child_text(elem, name):
+    for child in elem.iter():
+        if _local(child.tag) == name:
+            return child.text
+    return None
+
+
+def iter_track_points(fileobj):
+    """
+    Yield (lat, lon, timestamp) from a GPX or TCX stream.
+
+    Elements are dropped from the tree as soon as a point has been read, so memory
+    stays bounded however large the file is.
+    """
+    stack = []
+    for event, elem in iterparse(fileobj, events=('start', 'end')):
+        if event == 'start':
+            stack.append(elem)
+            continue
+        stack.pop()
+
+        tag = _local(elem.tag)
+        if tag == 'trkpt':
+            lat, lon = elem.get('lat'), elem.get('lon')
+            time = _child_text(elem, 'time')
+        elif tag == 'Trackpoint':
+            lat, lon = _child_text(elem, 'LatitudeDegrees'), _child_text(elem, 'LongitudeDegrees')
+            time = _child_text(elem, 'Time')
+        else:
+            # Let finished containers (tracks, laps, activities) go as well
+            if stack and tag not in ('time', 'Time', 'LatitudeDegrees', 'LongitudeDegrees', 'Position'):
+                stack[-1].remove(elem)
+            continue
+
+        if stack:
+            stack[-1].remove(elem)
+        point = _point(lat, lon, time)
+        if point:
+            yield point
+
+
+def _point(lat, lon, time):
+    try:
+        lat, lon = float(lat), float(lon)
+    except (TypeError, ValueError):
+        return None
+    ts = parse_datetime(time.strip()) if time else None
+    if ts is None or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    if timezone.is_naive(ts):
+        ts = ts.replace(tzinfo=dt_timezone.utc)
+    return lat, lon, ts
+
+
+def open_tracks(fileobj, name):
+    """Yield (name, file) for every track file in an upload: plain, gzipped or a zip archive of them."""
+    name = name.lower()
+    if name.endswith('.zip'):
+        with zipfile.ZipFile(fileobj) as archive:
+            for member in archive.infolist():
+                if member.filename.lower().endswith(TRACK_SUFFIXES):
+                    with archive.open(member) as stream:
+                        yield from open_tracks(stream, member.filename)
+    elif name.endswith('.gz'):
+        with gzip.open(fileobj) as stream:
+            yield name[:-3], stream
+    else:
+        yield name, fileobj
+
+
+class TrackImporter:
+    """
+    Turns a stream of points into runs, one per user and date as the unique constraint
+    requires; activities on the same day are merged. Points are written with
+    Run.add_points in batches; close() measures each run through the track pipeline and
+    adds calories and stats.
+    """
+
+    def __init__(self, user, batch_size=IMPORT_BATCH):
+        self.user = user
+        self.batch_size = batch_size
+        self.runs = {}
+        self.run = None
+        self.batch = []
+        self.summary = {'files': 0, 'failed_files': [], 'points': 0, 'created': 0}
+
+    def import_file(self, fileobj, name):
+        for track_name, stream in open_tracks(fileobj, name):
+            self.summary['files'] += 1
+            try:
+                for lat, lon, ts in iter_track_points(stream):
+                    self.add(lat, lon, ts)
+            except ParseError as exc:
+                self.summary['failed_files'].append({'file': track_name, 'error': str(exc)})
+            self.flush()
+
+    def add(self, lat, lon, ts):
+        day = timezone.localtime(ts).date()
+        if self.run is None or self.run.date != day:
+            self.flush()
+            self.run = self.runs.get(day)
+            if self.run is None:
+                self.run, _ = Run.objects.get_or_create(user=self.user, date=day)
+                self.runs[day] = self.run
+        self.batch.append({'lat': lat, 'lon': lon, 'ts': ts})
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            self.summary['points'] += len(self.batch)
+            self.summary['created'] += len(self.run.add_points(self.batch))
+            self.batch = []
+
+    def close(self):
+        self.flush()
+        finished = timezone.now()
+        for run in self.runs.values():
+            if run.point_count < 2:
+                continue
+            distance, run.duration, run.summary = measure(run.iter_track())
+            run.distance = round(distance, 2)
+            run.calories = calc_calories(run.distance, run.duration, self.user.weight)
+            run.finished_at = run.finished_at or finished
+            with transaction.atomic():
+                run.save(update_fields=['distance', 'duration', 'calories', 'summary', 'finished_at'])
+                record_run(run)
+                record_heat(run)
+        self.summary['runs'] = len(self.runs)
+        return self.summary
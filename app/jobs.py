@@ -0,0 +1,175 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from app.models import Job
+
+logger = logging.getLogger(__name__)
+
+# Job kinds and the functions that run them. A task gets the job's args as keyword
+# arguments and returns a JSON serializable result.
+TASKS = {
+    'finish_run': 'app.tasks.finish_run',
+}
+CLAIM_CANDIDATES = 5
+
+
+class TaskError(Exception):
+    """Raised by a task for errors a retry won't fix; the job fails at once with the message."""
+
+
+def enqueue(kind, key, user=None, delay=0, **args):
+    """
+    Queue a job and return it. If a job with the same key is queued, running or done
+    that job is returned instead, so a repeated request doesn't repeat the work; keys
+    should change when the input does. Only failed jobs can be queued again. The runner
+    starts the job `delay` seconds from now at the earliest.
+    """
+    active = Job.objects.filter(key=key).exclude(status=Job.FAILED)
+    job = active.first()
+    if job is not None:
+        return job
+    try:
+        with transaction.atomic():
+            job = Job.objects.create(
+                kind=kind, key=key, user=user, args=args, max_attempts=settings.JOB_MAX_ATTEMPTS,
+                run_after=timezone.now() + timedelta(seconds=delay),
+            )
+    except IntegrityError:
+        # Lost the race to a concurrent enqueue of the same work
+        return active.get()
+
+    if settings.JOB_RUN_INLINE:
+        # Inline jobs don't wait for their delay
+        while claim(job.id):
+            runner.execute(job.id)
+        job.refresh_from_db()
+    else:
+        transaction.on_commit(runner.notify)
+    return job
+
+
+def claim(job_id, now=None):
+    # Conditional update, so of all the runners polling the table exactly one gets the job
+    now = now or timezone.now()
+    return Job.objects.filter(id=job_id, status=Job.QUEUED).update(
+        status=Job.RUNNING, started_at=now, attempts=F('attempts') + 1,
+    )
+
+
+class JobRunner:
+    """
+    Runs queued jobs on a thread pool inside the web process; the Job table is the queue,
+    so there is no broker. Every process can run one (gunicorn.conf.py starts it in each
+    worker, enqueue starts it on demand) and claim() makes sure a job runs once. Failed
+    jobs are retried after JOB_RETRY_DELAY seconds, doubled per attempt, up to
+    max_attempts. Jobs still marked running after JOB_TIMEOUT_SECONDS lost their process
+    and are queued again.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.pool = None
+        self.slots = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.pool = ThreadPoolExecutor(settings.JOB_WORKERS, thread_name_prefix='job')
+            self.slots = threading.Semaphore(settings.JOB_WORKERS)
+            self.thread = threading.Thread(target=self._loop, name='job-runner', daemon=True)
+            self.thread.start()
+
+    def notify(self):
+        self.start()
+        self.wakeup.set()
+
+    def stop(self):
+        # Finish the jobs in hand, queued ones are left for the other processes
+        if self.thread is None:
+            return
+        self.stopping.set()
+        self.wakeup.set()
+        self.thread.join()
+        self.pool.shutdown(wait=True)
+
+    def _loop(self):
+        while not self.stopping.is_set():
+            close_old_connections()
+            try:
+                self.requeue_lost()
+                while self.slots.acquire(blocking=False):
+                    job_id = self.claim_next()
+                    if job_id is None:
+                        self.slots.release()
+                        break
+                    self.pool.submit(self._work, job_id)
+            except Exception:
+                logger.exception("Job runner poll failed")
+            self.wakeup.wait(settings.JOB_POLL_SECONDS)
+            self.wakeup.clear()
+
+    def claim_next(self):
+        now = timezone.now()
+        candidates = (
+            Job.objects.filter(status=Job.QUEUED, run_after__lte=now)
+            .order_by('run_after', 'id')
+            .values_list('id', flat=True)[:CLAIM_CANDIDATES]
+        )
+        for job_id in candidates:
+            if claim(job_id, now):
+                return job_id
+        return None
+
+    def requeue_lost(self):
+        cutoff = timezone.now() - timedelta(seconds=settings.JOB_TIMEOUT_SECONDS)
+        lost = Job.objects.filter(status=Job.RUNNING, started_at__lt=cutoff)
+        lost.filter(attempts__gte=F('max_attempts')).update(
+            status=Job.FAILED, error='Timed out', finished_at=timezone.now(),
+        )
+        lost.update(status=Job.QUEUED)
+
+    def _work(self, job_id):
+        try:
+            self.execute(job_id)
+        finally:
+            close_old_connections()
+            self.slots.release()
+            self.wakeup.set()
+
+    def execute(self, job_id):
+        # The job must have been claimed
+        job = Job.objects.get(id=job_id)
+        try:
+            result = import_string(TASKS[job.kind])(**job.args)
+        except Exception as exc:
+            if isinstance(exc, TaskError):
+                logger.info("Job %s (%s) failed: %s", job.id, job.kind, exc)
+            else:
+                logger.exception("Job %s (%s) failed on attempt %d", job.id, job.kind, job.attempts)
+            now = timezone.now()
+            retry = job.attempts < job.max_attempts and not isinstance(exc, TaskError)
+            Job.objects.filter(id=job.id).update(
+                status=Job.QUEUED if retry else Job.FAILED,
+                error=str(exc) if isinstance(exc, TaskError) else f'{type(exc).__name__}: {exc}',
+                run_after=now + timedelta(seconds=settings.JOB_RETRY_DELAY * 2 ** (job.attempts - 1)),
+                finished_at=None if retry else now,
+            )
+            return
+        Job.objects.filter(id=job.id).update(
+            status=Job.DONE, result=result, error='', finished_at=timezone.now(),
+        )
+
+
+runner = JobRunner()
@@ -0,0 +1,109 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+from django.conf import settings
+from django.core import signing
+
+SHARE_SALT = 'app.live.share'
+
+
+class RunFeed:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.points = deque(maxlen=settings.LIVE_BUFFER_POINTS)
+        self.seq = 0
+        self.finished = False
+        self.updated = time.monotonic()
+
+
+class LiveFeed:
+    """
+    Recent points of the runs in progress, kept in process memory for live followers.
+
+    Every published point gets the next sequence number of its run; followers pass the
+    last number they saw as the cursor and get only newer points back. Each run keeps the
+    last LIVE_BUFFER_POINTS points, at most LIVE_MAX_RUNS runs are tracked and runs idle
+    for LIVE_IDLE_SECONDS are dropped. Nothing here touches the database.
+
+    Only the runner and holders of a share token (share_token) may follow a run, see
+    can_follow. The buffer is per process, so followers only see points posted to the same process:
+    serve live tracking from a single (ASGI) worker or route a run's traffic to one.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.runs = OrderedDict()
+
+    def publish(self, run_id, user_id, points):
+        with self.lock:
+            run = self.runs.get(run_id)
+            if run is None or run.finished:
+                run = self.runs[run_id] = RunFeed(user_id)
+            for point in points:
+                run.seq += 1
+                run.points.append((run.seq, {'lat': point['lat'], 'lon': point['lon'], 'ts': point['ts']}))
+            run.updated = time.monotonic()
+            self.runs.move_to_end(run_id)
+            self._prune()
+
+    def finish(self, run_id):
+        with self.lock:
+            run = self.runs.get(run_id)
+            if run is not None:
+                run.finished = True
+                run.updated = time.monotonic()
+
+    def _prune(self):
+        idle = time.monotonic() - settings.LIVE_IDLE_SECONDS
+        while self.runs:
+            oldest = next(iter(self.runs.values()))
+            if len(self.runs) <= settings.LIVE_MAX_RUNS and oldest.updated >= idle:
+                break
+            self.runs.popitem(last=False)
+
+    def owner(self, run_id):
+        with self.lock:
+            run = self.runs.get(run_id)
+            return run.user_id if run is not None else None
+
+    def since(self, run_id, cursor):
+        """
+        {'cursor', 'points', 'finished', 'reset'} for the points after `cursor`, or None
+        if the run isn't live in this process. `reset` means points between the cursor
+        and the oldest buffered one were dropped (or the process restarted) and the
+        client should reload the track before following again.
+        """
+        with self.lock:
+            run = self.runs.get(run_id)
+            if run is None:
+                return None
+            first = run.points[0][0] if run.points else run.seq + 1
+            reset = cursor > run.seq or cursor < first - 1
+            if reset:
+                cursor = first - 1
+            return {
+                'cursor': run.seq,
+                'points': [point for seq, point in run.points if seq > cursor],
+                'finished': run.finished,
+                'reset': reset,
+            }
+
+
+def share_token(run_id):
+    # Signed, so a run can be shared without storing anything; valid for LIVE_SHARE_SECONDS
+    return signing.dumps(run_id, salt=SHARE_SALT)
+
+
+def can_follow(run_id, owner_id, user_id, share=None):
+    if owner_id == user_id:
+        return True
+    if not share:
+        return False
+    try:
+        return signing.loads(share, salt=SHARE_SALT, max_age=settings.LIVE_SHARE_SECONDS) == run_id
+    except signing.BadSignature:
+        return False
+
+
+feed = LiveFeed()
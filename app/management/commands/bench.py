@@ -0,0 +1,52 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from app.benchmark import Benchmark
+
+
+class Command(BaseCommand):
+    help = "Benchmark the API hot paths on synthetic data in a throwaway test database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=5)
+        parser.add_argument('--runs', type=int, default=3, help="Historical runs per user")
+        parser.add_argument('--points', type=int, default=3600, help="GPS points per historical run")
+        parser.add_argument('--territories', type=int, default=2000)
+        parser.add_argument('--iterations', type=int, default=50, help="Requests per endpoint")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', action='store_true', help="Print machine readable results")
+
+    def handle(self, *args, **options):
+        bench = Benchmark(
+            users=options['users'], runs=options['runs'], points=options['points'],
+            territories=options['territories'], iterations=options['iterations'], seed=options['seed'],
+        )
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            # A cache of its own, the shared file cache may hold a live server's responses
+            with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+                bench.setup()
+                results = bench.run()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options['json']:
+            self.stdout.write(json.dumps({'meta': bench.meta, 'endpoints': results}, indent=2))
+            return
+
+        self.stdout.write(', '.join(f"{key}={value}" for key, value in bench.meta.items()))
+        header = f"{'endpoint':<44}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for name, row in results.items():
+            self.stdout.write(
+                f"{name:<44}{row['throughput_rps']:>9}{row['p50_ms']:>9}{row['p95_ms']:>9}"
+                f"{row['p99_ms']:>9}{row['queries_mean']:>9}"
+            )
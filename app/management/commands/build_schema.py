@@ -0,0 +1,21 @@
+import gzip
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = "Write the OpenAPI schema to a static file (run after collectstatic)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=str(settings.OPENAPI_SCHEMA_FILE))
+
+    def handle(self, *args, **options):
+        path = options['output']
+        call_command('generate_swagger', path, overwrite=True, format='json')
+
+        # Whitenoise serves the precompressed copy to clients that accept gzip
+        with open(path, 'rb') as src, gzip.open(f'{path}.gz', 'wb') as dst:
+            dst.write(src.read())
+        self.stdout.write(self.style.SUCCESS(f"Wrote {path}"))
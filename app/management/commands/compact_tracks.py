@@ -0,0 +1,35 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from app.models import Run
+
+
+class Command(BaseCommand):
+    help = "Pack the GPS points of finished runs into one compressed blob per run"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.TRACK_COMPACT_AFTER_DAYS,
+                            help="Only compact runs at least this many days old")
+        parser.add_argument('--limit', type=int, default=None, help="Stop after this many runs")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.localdate() - timedelta(days=options['days'])
+        runs = Run.objects.filter(track_packed=False, finished_at__isnull=False, date__lte=cutoff).order_by('date', 'id')
+        if options['limit']:
+            runs = runs[:options['limit']]
+
+        compacted = rows = size = 0
+        for run in runs.iterator():
+            deleted = run.compact_track()
+            if not deleted:
+                continue
+            compacted += 1
+            rows += deleted
+            size += len(run.track.data)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Compacted {compacted} runs: {rows} location rows packed into {size} bytes"
+        ))
@@ -0,0 +1,28 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.importer import TrackImporter
+from app.models import User
+
+
+class Command(BaseCommand):
+    help = "Import GPX/TCX files (plain, .gz or .zip archives) as runs of a user"
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('paths', nargs='+')
+        parser.add_argument('--batch-size', type=int, default=2000, help="Points per bulk insert")
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options['username']).first()
+        if user is None:
+            raise CommandError(f"Unknown user {options['username']}")
+
+        importer = TrackImporter(user, batch_size=options['batch_size'])
+        for path in options['paths']:
+            with open(path, 'rb') as fileobj:
+                importer.import_file(fileobj, path)
+            self.stdout.write(f"{path}: {importer.summary['points']} points so far")
+
+        self.stdout.write(self.style.SUCCESS(json.dumps(importer.close(), default=str)))
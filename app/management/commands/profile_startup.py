@@ -0,0 +1,64 @@
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Run in a fresh interpreter so nothing is imported yet: set Django up, load the WSGI
+# application and the URLconf (which pulls in the views), as a worker does on its first request
+STARTUP = (
+    "import time; started = time.perf_counter()\n"
+    "from django.core.wsgi import get_wsgi_application; get_wsgi_application()\n"
+    "from django.urls import get_resolver; get_resolver().url_patterns\n"
+    "print(time.perf_counter() - started)\n"
+)
+
+
+def parse_importtime(output):
+    """
+    Cumulative import time in microseconds of each top-level package, from `python -X importtime`.
+    A dependency is charged to the first package that imports it (numpy shows up under app).
+    """
+    totals = defaultdict(int)
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not cumulative.strip().isdigit() or name[1:2] == ' ':
+            # Header line, or nested inside another import and already counted there
+            continue
+        totals[name.strip().split('.')[0]] += int(cumulative)
+    return totals
+
+
+class Command(BaseCommand):
+    help = "Measure worker startup and report import time per package and installed app"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=20, help="Packages to list")
+
+    def handle(self, *args, **options):
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'RunQuestAi.settings')}
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', STARTUP],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        if result.returncode:
+            raise CommandError(result.stderr.strip().splitlines()[-1])
+
+        totals = parse_importtime(result.stderr)
+        apps = defaultdict(list)
+        for app in settings.INSTALLED_APPS:
+            apps[app.split('.')[0]].append(app)
+
+        self.stdout.write(f"{'package':<28}{'ms':>10}  installed apps")
+        ranked = sorted(totals.items(), key=lambda item: item[1], reverse=True)
+        for package, micros in ranked[:options['top']]:
+            self.stdout.write(f"{package:<28}{micros / 1000:>10.1f}  {', '.join(apps.get(package, []))}")
+
+        wall = float(result.stdout.strip().splitlines()[-1])
+        self.stdout.write(self.style.SUCCESS(
+            f"Startup took {wall * 1000:.0f} ms, {sum(totals.values()) / 1000:.0f} ms of it in imports"
+        ))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from app.heatmap import rebuild_heatmap
+
+
+class Command(BaseCommand):
+    help = "Rebuild the heatmap cells from finished runs"
+
+    def handle(self, *args, **options):
+        points = rebuild_heatmap()
+        self.stdout.write(self.style.SUCCESS(f"Counted {points} points into the heatmap"))
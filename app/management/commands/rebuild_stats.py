@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from app.stats import rebuild_stats
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per-user day/week/month stats from finished runs"
+
+    def handle(self, *args, **options):
+        rows = rebuild_stats()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} stat rows"))
@@ -0,0 +1,59 @@
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from app.models import Run
+from app.recompute import recompute_runs
+from app.stats import rebuild_stats
+
+
+class Command(BaseCommand):
+    help = "Recompute distance, duration, calories and summaries of runs from their GPS tracks"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', default=[], help="Username or id, can be repeated")
+        parser.add_argument('--since', help="Only runs on or after this date (YYYY-MM-DD)")
+        parser.add_argument('--until', help="Only runs on or before this date (YYYY-MM-DD)")
+        parser.add_argument('--chunk-size', type=int, default=200, help="Runs per chunk")
+        parser.add_argument('--workers', type=int, default=None, help="Worker processes, 1 runs inline")
+        parser.add_argument('--checkpoint', default=str(settings.BASE_DIR / '.recompute_runs.checkpoint'),
+                            help="File recording the last run id written")
+        parser.add_argument('--resume', action='store_true', help="Continue after the id in the checkpoint file")
+        parser.add_argument('--no-stats', action='store_true', help="Don't rebuild user stats afterwards")
+
+    def handle(self, *args, **options):
+        # Simplified tracks no longer reproduce the distance measured on the full track, and
+        # runs in progress keep their own running totals while points come in
+        runs = Run.objects.filter(track_simplified=False, finished_at__isnull=False)
+        for user in options['user']:
+            runs = runs.filter(user_id=int(user)) if user.isdigit() else runs.filter(user__username=user)
+        for option, lookup in (('since', 'date__gte'), ('until', 'date__lte')):
+            if options[option]:
+                value = parse_date(options[option])
+                if value is None:
+                    raise CommandError(f"--{option} must be YYYY-MM-DD")
+                runs = runs.filter(**{lookup: value})
+
+        checkpoint = Path(options['checkpoint'])
+        if options['resume'] and checkpoint.exists():
+            last_id = int(checkpoint.read_text().strip() or 0)
+            runs = runs.filter(id__gt=last_id)
+            self.stdout.write(f"Resuming after run {last_id}")
+
+        total = runs.count()
+        started = time.monotonic()
+
+        def progress(last_id, done):
+            checkpoint.write_text(str(last_id))
+            rate = done / max(time.monotonic() - started, 1e-6)
+            self.stdout.write(f"{done}/{total} runs ({done / total:.1%}), {rate:.0f} runs/s, last id {last_id}")
+
+        done = recompute_runs(runs, chunk_size=options['chunk_size'], workers=options['workers'], on_chunk=progress)
+        checkpoint.unlink(missing_ok=True)
+
+        if done and not options['no_stats']:
+            rebuild_stats()
+        self.stdout.write(self.style.SUCCESS(f"Recomputed {done} runs in {time.monotonic() - started:.1f}s"))
@@ -0,0 +1,20 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from app.jobs import runner
+
+
+class Command(BaseCommand):
+    help = "Run background jobs in a process of their own until interrupted"
+
+    def handle(self, *args, **options):
+        signal.signal(signal.SIGTERM, lambda *_: runner.stopping.set())
+        runner.start()
+        self.stdout.write(self.style.SUCCESS("Running jobs, Ctrl+C to stop"))
+        try:
+            while not runner.stopping.wait(1):
+                pass
+        except KeyboardInterrupt:
+            pass
+        runner.stop()
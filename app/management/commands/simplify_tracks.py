@@ -0,0 +1,42 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from app.models import Run
+
+
+class Command(BaseCommand):
+    help = "Simplify the GPS tracks of old finished runs, keeping their stored totals"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.TRACK_SIMPLIFY_AFTER_DAYS,
+                            help="Only simplify runs at least this many days old")
+        parser.add_argument('--tolerance', type=float, default=settings.TRACK_SIMPLIFY_TOLERANCE,
+                            help="Max distance in meters between a dropped point and the simplified track")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Location rows per DELETE")
+        parser.add_argument('--limit', type=int, default=None, help="Stop after this many runs")
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would be reclaimed")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.localdate() - timedelta(days=options['days'])
+        runs = Run.objects.filter(
+            track_simplified=False, finished_at__isnull=False, date__lte=cutoff,
+        ).select_related('track').order_by('date', 'id')
+        if options['limit']:
+            runs = runs[:options['limit']]
+
+        simplified = points = size = 0
+        for run in runs.iterator(chunk_size=100):
+            removed, reclaimed = run.simplify_track(
+                options['tolerance'], batch_size=options['batch_size'], dry_run=options['dry_run'],
+            )
+            simplified += 1
+            points += removed
+            size += reclaimed
+
+        verb = "Would remove" if options['dry_run'] else "Removed"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {points} points from {simplified} runs, about {size} bytes"
+        ))
@@ -0,0 +1,96 @@
+import os
+import threading
+from bisect import bisect_left
+
+from django.conf import settings
+from django.http import HttpResponse
+
+# Counters live in process memory: each gunicorn worker counts only the requests it
+# served, and a scrape of /metrics/ is answered by whichever worker takes it. Every series
+# is labelled worker="<pid>" so the workers' counters stay separate series and rate()
+# holds per series; sum by view across workers. To see every worker each one has to be
+# scraped separately, e.g. run one single-worker gunicorn per port as its own target,
+# otherwise workers the scrapes don't reach are missing. A restarted worker has a new pid.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels, value):
+        counts, total = self.series.get(labels, (None, 0))
+        if counts is None:
+            counts = [0] * (len(self.buckets) + 1)
+        counts[bisect_left(self.buckets, value)] += 1
+        self.series[labels] = (counts, total + value)
+
+    def expose(self, worker=()):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for labels, (counts, total) in sorted(self.series.items()):
+            base = _labels(worker + labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{base},le="{bound}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{self.name}_bucket{{{base},le="+Inf"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{base}}} {total:.6f}')
+            lines.append(f'{self.name}_count{{{base}}} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.histograms = {
+            'total': Histogram('runquest_request_duration_seconds', 'Total request time.', DURATION_BUCKETS),
+            'db': Histogram('runquest_request_db_seconds', 'Time spent in SQL queries.', DURATION_BUCKETS),
+            'serializer': Histogram('runquest_request_serializer_seconds', 'Time spent in DRF serializers.',
+                                    DURATION_BUCKETS),
+            'queries': Histogram('runquest_request_queries', 'SQL queries per request.', QUERY_BUCKETS),
+            'size': Histogram('runquest_response_size_bytes', 'Response body size.', SIZE_BUCKETS),
+        }
+
+    def observe(self, view, method, status, **values):
+        labels = (('view', view), ('method', method))
+        with self.lock:
+            key = labels + (('status', str(status)),)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            for name, value in values.items():
+                if value is not None:
+                    self.histograms[name].observe(labels, value)
+
+    def expose(self):
+        worker = (('worker', str(os.getpid())),)
+        with self.lock:
+            lines = ['# HELP runquest_requests_total Requests served.', '# TYPE runquest_requests_total counter']
+            lines += [f'runquest_requests_total{{{_labels(worker + key)}}} {count}'
+                      for key, count in sorted(self.requests.items())]
+            for histogram in self.histograms.values():
+                lines += histogram.expose(worker)
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(pairs):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in pairs)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
+
+
+def metrics_view(request):
+    token = settings.METRICS_TOKEN
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponse(status=401)
+    return HttpResponse(registry.expose(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,113 @@
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connection
+from rest_framework.serializers import BaseSerializer
+
+from app.metrics import registry
+
+logger = logging.getLogger('app.performance')
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self, capture_sql):
+        self.capture_sql = capture_sql
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+        self.sql = []
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.queries += 1
+            self.db_time += elapsed
+            if self.capture_sql:
+                self.sql.append((round(elapsed * 1000, 2), sql))
+
+
+@contextmanager
+def serializer_timer():
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+
+    # Serializers may call other serializers' .data, only the outermost call is counted
+    metrics.serializer_depth += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.serializer_depth -= 1
+        if not metrics.serializer_depth:
+            metrics.serializer_time += time.perf_counter() - started
+
+
+def instrument_serializers():
+    # Serializer.data and ListSerializer.data both go through BaseSerializer.data
+    original = BaseSerializer.data
+    if getattr(original.fget, 'instrumented', False):
+        return
+
+    def data(self):
+        with serializer_timer():
+            return original.fget(self)
+
+    data.instrumented = True
+    BaseSerializer.data = property(data)
+
+
+class PerformanceMiddleware:
+    """
+    Records SQL query count, DB time, serializer time, total time and response size per
+    view, adds them as a Server-Timing header and feeds the /metrics histograms.
+    Requests slower than PERF_SLOW_REQUEST_MS are logged with their SQL.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        slow_ms = settings.PERF_SLOW_REQUEST_MS
+        metrics = RequestMetrics(capture_sql=bool(slow_ms))
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(metrics.execute_wrapper):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total = time.perf_counter() - started
+
+        size = None if response.streaming else len(response.content)
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.queries} queries"',
+            f'serializer;dur={metrics.serializer_time * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ])
+
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        registry.observe(
+            view, request.method, response.status_code,
+            total=total, db=metrics.db_time, serializer=metrics.serializer_time,
+            queries=metrics.queries, size=size,
+        )
+
+        if slow_ms and total * 1000 >= slow_ms:
+            logger.warning(
+                "Slow request %s %s (%s): %.0f ms, %d queries, %.0f ms in db\n%s",
+                request.method, request.get_full_path(), view, total * 1000, metrics.queries,
+                metrics.db_time * 1000, '\n'.join(f'  [{ms} ms] {sql}' for ms, sql in metrics.sql),
+            )
+        return response
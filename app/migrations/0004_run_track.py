@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_run_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='run',
+            name='track_packed',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='RunTrack',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.BinaryField()),
+                ('point_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('run', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='track', to='app.run')),
+            ],
+        ),
+    ]
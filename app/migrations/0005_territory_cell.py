@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:42
+
+from django.db import migrations, models
+
+from app.spatial import cell_for
+
+
+def fill_cells(apps, schema_editor):
+    Territory = apps.get_model('app', 'Territory')
+    territories = list(Territory.objects.only('id', 'center_lat', 'center_lon'))
+    for territory in territories:
+        territory.cell = cell_for(territory.center_lat, territory.center_lon)
+    Territory.objects.bulk_update(territories, ['cell'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_run_track'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='territory',
+            name='cell',
+            field=models.BigIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(fill_cells, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_territory_cell'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='runlocation',
+            index=models.Index(fields=['run', 'timestamp'], name='app_runloca_run_id_3560f2_idx'),
+        ),
+    ]
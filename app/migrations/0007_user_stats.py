@@ -0,0 +1,37 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:46
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_runlocation_run_timestamp_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='run',
+            name='finished_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='UserStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', 'Day'), ('week', 'Week'), ('month', 'Month')], max_length=5)),
+                ('period_start', models.DateField()),
+                ('distance', models.FloatField(default=0)),
+                ('duration', models.PositiveIntegerField(default=0)),
+                ('calories', models.FloatField(default=0)),
+                ('run_count', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['period', 'period_start', '-distance'], name='app_usersta_period_f3c5a2_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'period', 'period_start'), name='unique_user_period_stat')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_user_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='run',
+            name='track_simplified',
+            field=models.BooleanField(default=False),
+        ),
+    ]
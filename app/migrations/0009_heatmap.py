@@ -0,0 +1,35 @@
+# Generated by Django 5.2.8 on 2026-10-18 13:58
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_run_track_simplified'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='run',
+            name='heatmap_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='HeatCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('zoom', models.PositiveSmallIntegerField()),
+                ('tile_x', models.PositiveIntegerField()),
+                ('tile_y', models.PositiveIntegerField()),
+                ('cell', models.PositiveSmallIntegerField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='heat_cells', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(condition=models.Q(('user__isnull', True)), fields=('zoom', 'tile_x', 'tile_y', 'cell'), name='unique_heat_cell'), models.UniqueConstraint(condition=models.Q(('user__isnull', False)), fields=('user', 'zoom', 'tile_x', 'tile_y', 'cell'), name='unique_user_heat_cell')],
+            },
+        ),
+    ]
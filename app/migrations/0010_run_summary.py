@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 14:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_heatmap'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='run',
+            name='summary',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+
+def fill_finished_at(apps, schema_editor):
+    # Runs measured before finished_at existed. A run of an earlier day with a distance is
+    # done; today's runs may still be going and get finished_at when they finish.
+    Run = apps.get_model('app', 'Run')
+    Run.objects.filter(
+        finished_at__isnull=True, distance__gt=0, date__lt=timezone.localdate(),
+    ).update(finished_at=Coalesce('ended_at', 'created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_sync'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_finished_at, migrations.RunPython.noop),
+    ]
@@ -1,27 +1,87 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.db.backends.signals import connection_created
 from django.contrib.auth.models import AbstractUser
-from django.db.models.signals import pre_save
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
+from django.utils import timezone
+
+from app import cache, geo, spatial
+from app.track import pack_track, unpack_track
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    # WAL lets readers run alongside the single writer; busy_timeout waits for the write
+    # lock instead of failing with "database is locked" straight away
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute(f'PRAGMA busy_timeout={settings.SQLITE_BUSY_TIMEOUT_MS}')
+        cursor.execute('PRAGMA temp_store=MEMORY')
 
 
 class User(AbstractUser):
     height = models.PositiveIntegerField(null=True, blank=True)
     weight = models.PositiveIntegerField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.username
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        user = super().from_db(db, field_names, values)
+        # invalidate_user tells renames from other saves by it
+        user._saved_username = user.__dict__.get('username')
+        return user
+
 
 class Territory(models.Model):
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
     center_lat = models.FloatField()
     center_lon = models.FloatField()
     radius = models.FloatField(default=200)
+    # Grid cell of the center, see app.spatial
+    cell = models.BigIntegerField(default=0, editable=False, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Changes since a sync token are found through this index (/sync/)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.owner.username
 
+    def save(self, *args, **kwargs):
+        self.cell = spatial.cell_for(self.center_lat, self.center_lon)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            extra = {'updated_at', 'cell'} if {'center_lat', 'center_lon'} & set(update_fields) else {'updated_at'}
+            kwargs['update_fields'] = {*update_fields, *extra}
+        super().save(*args, **kwargs)
+
+
+@receiver([post_save, post_delete], sender=Territory)
+def invalidate_territories(sender, instance, **kwargs):
+    cache.bump_version(cache.TERRITORIES)
+
+
+@receiver(post_delete, sender=Territory)
+def territory_tombstone(sender, instance, **kwargs):
+    Tombstone.objects.create(kind=Tombstone.TERRITORY, object_id=instance.pk)
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_user(sender, instance, created=False, update_fields=None, **kwargs):
+    cache.bump_version(cache.user_namespace(instance.pk))
+    renamed = instance.username != getattr(instance, '_saved_username', None)
+    if not created and renamed and (update_fields is None or 'username' in update_fields):
+        # Territories show the owner's username. Other saves, e.g. last_login on every
+        # login, leave them alone.
+        cache.bump_version(cache.TERRITORIES)
+    instance._saved_username = instance.username
+
 
 class Run(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='runs')
@@ -31,12 +91,30 @@ class Run(models.Model):
     calories = models.FloatField(null=True, blank=True)
     territory = models.ForeignKey(Territory, on_delete=models.SET_NULL, null=True, blank=True)
 
+    # Running totals, kept up to date as points are ingested
+    point_count = models.PositiveIntegerField(default=0)
+    started_at = models.DateTimeField(null=True, blank=True)
+    ended_at = models.DateTimeField(null=True, blank=True)
+    last_lat = models.FloatField(null=True, blank=True)
+    last_lon = models.FloatField(null=True, blank=True)
+    # Points were moved from RunLocation rows into a packed RunTrack blob
+    track_packed = models.BooleanField(default=False)
+    # Redundant points were dropped by simplify_track; the totals were measured on the full track
+    track_simplified = models.BooleanField(default=False)
+    # Points up to this time have been counted into the heatmap (app.heatmap)
+    heatmap_until = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Splits, best pace, max speed and moving time, computed at finish (app.pipeline.measure)
+    summary = models.JSONField(null=True, blank=True)
+
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         indexes = [
             models.Index(fields=['user', 'date']),
             models.Index(fields=['territory', 'date']),
+            models.Index(fields=['user', 'updated_at']),
         ]
         ordering = ['-date']
         constraints = [
@@ -46,6 +124,164 @@ class Run(models.Model):
     def __str__(self):
         return f"{self.user} | {self.date} | {self.distance}m"
 
+    def save(self, *args, **kwargs):
+        # Partial saves still count as a change for /sync/
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'updated_at'}
+        super().save(*args, **kwargs)
+
+    def add_points(self, points):
+        # points: validated dicts with lat, lon, ts. Duplicate timestamps (inside the batch
+        # or already stored) are skipped so a retried upload doesn't double the track.
+        points = sorted({p['ts']: p for p in points}.values(), key=lambda p: p['ts'])
+        if not points:
+            return []
+
+        with transaction.atomic():
+            if self.track_packed:
+                self.expand_track()
+            existing = set(
+                self.locations.filter(timestamp__range=(points[0]['ts'], points[-1]['ts']))
+                .values_list('timestamp', flat=True)
+            )
+            new = [
+                RunLocation(run=self, lat=p['lat'], lon=p['lon'], timestamp=p['ts'])
+                for p in points if p['ts'] not in existing
+            ]
+            if new:
+                RunLocation.objects.bulk_create(new)
+                self._accumulate(new)
+        return new
+
+    def _accumulate(self, new):
+        totals = Run.objects.select_for_update().values(*TOTAL_FIELDS).get(pk=self.pk)
+        for field, value in totals.items():
+            setattr(self, field, value)
+
+        if self.ended_at and new[0].timestamp < self.ended_at:
+            # Late points land inside the track, so the totals can't be extended
+            self.recompute_totals()
+            return
+
+        lats = [loc.lat for loc in new]
+        lons = [loc.lon for loc in new]
+        if self.point_count:
+            lats.insert(0, self.last_lat)
+            lons.insert(0, self.last_lon)
+        else:
+            self.started_at = new[0].timestamp
+        self.distance += geo.track_distance(lats, lons)
+
+        self.ended_at = new[-1].timestamp
+        self.last_lat, self.last_lon = lats[-1], lons[-1]
+        self.point_count += len(new)
+        self.duration = int((self.ended_at - self.started_at).total_seconds())
+        self.save(update_fields=TOTAL_FIELDS)
+
+    def recompute_totals(self):
+        self.distance, self.duration, self.point_count = 0, 0, 0
+        self.started_at = self.ended_at = self.last_lat = self.last_lon = None
+
+        lats, lons, timestamps = self.track_points()
+        if timestamps:
+            self.distance = geo.track_distance(lats, lons)
+            self.point_count = len(timestamps)
+            self.started_at, self.ended_at = timestamps[0], timestamps[-1]
+            self.last_lat, self.last_lon = lats[-1], lons[-1]
+            self.duration = int((self.ended_at - self.started_at).total_seconds())
+        self.save(update_fields=TOTAL_FIELDS)
+
+    def track_points(self):
+        # (lats, lons, timestamps) ordered by time, from whichever storage holds the track
+        if self.track_packed:
+            return unpack_track(self.track.data)
+        rows = list(self.locations.order_by('timestamp').values_list('lat', 'lon', 'timestamp'))
+        if not rows:
+            return [], [], []
+        return tuple(list(col) for col in zip(*rows))
+
+    def iter_track(self, chunk_size=2000):
+        # (lat, lon, timestamp) in time order without materializing the run's rows
+        if self.track_packed:
+            yield from zip(*unpack_track(self.track.data))
+            return
+        rows = self.locations.order_by('timestamp').values_list('lat', 'lon', 'timestamp')
+        yield from rows.iterator(chunk_size=chunk_size)
+
+    def packed_locations(self):
+        # Unsaved RunLocation instances decoded from the packed track, for serializers
+        return [
+            RunLocation(run=self, lat=lat, lon=lon, timestamp=ts)
+            for lat, lon, ts in zip(*unpack_track(self.track.data))
+        ]
+
+    def compact_track(self):
+        with transaction.atomic():
+            lats, lons, timestamps = self.track_points()
+            if self.track_packed or not timestamps:
+                return 0
+            if not self.point_count:
+                # Track was stored before running totals existed; without rows finish could
+                # no longer count it. distance and duration keep the values measured at finish.
+                self.point_count = len(timestamps)
+                self.started_at, self.ended_at = timestamps[0], timestamps[-1]
+                self.last_lat, self.last_lon = lats[-1], lons[-1]
+            data = pack_track(lats, lons, timestamps)
+            RunTrack.objects.update_or_create(run=self, defaults={'data': data, 'point_count': len(timestamps)})
+            deleted, _ = self.locations.all().delete()
+            self.track_packed = True
+            self.save(update_fields=['track_packed', 'point_count', 'started_at', 'ended_at', 'last_lat', 'last_lon'])
+        return deleted
+
+    def simplify_track(self, tolerance, batch_size=1000, dry_run=False):
+        """
+        Drop the points that lie within `tolerance` meters of the Douglas–Peucker line
+        (geo.simplify). distance, duration and calories keep the values measured on the
+        full track. Returns (points removed, bytes reclaimed); with dry_run nothing is written.
+        """
+        with transaction.atomic():
+            if self.track_packed:
+                lats, lons, timestamps = unpack_track(self.track.data)
+            else:
+                rows = list(self.locations.order_by('timestamp').values_list('id', 'lat', 'lon', 'timestamp'))
+                ids, lats, lons, timestamps = (list(col) for col in zip(*rows)) if rows else ([], [], [], [])
+
+            keep = geo.simplify(lats, lons, tolerance)
+            removed = len(timestamps) - len(keep)
+            if self.track_packed:
+                data = pack_track([lats[i] for i in keep], [lons[i] for i in keep], [timestamps[i] for i in keep])
+                reclaimed = len(self.track.data) - len(data)
+            else:
+                reclaimed = removed * LOCATION_ROW_BYTES
+            if dry_run:
+                return removed, reclaimed
+
+            if removed and self.track_packed:
+                RunTrack.objects.filter(run=self).update(data=data, point_count=len(keep))
+            elif removed:
+                kept = set(keep.tolist())
+                drop = [pk for i, pk in enumerate(ids) if i not in kept]
+                for start in range(0, len(drop), batch_size):
+                    RunLocation.objects.filter(id__in=drop[start:start + batch_size]).delete()
+            self.point_count = len(keep)
+            self.track_simplified = True
+            self.save(update_fields=['point_count', 'track_simplified'])
+        return removed, reclaimed
+
+    def expand_track(self):
+        with transaction.atomic():
+            RunLocation.objects.bulk_create(self.packed_locations())
+            self.track.delete()
+            self.track_packed = False
+            self.save(update_fields=['track_packed'])
+
+
+# Rough on-disk size of one RunLocation row with its index entries in SQLite
+LOCATION_ROW_BYTES = 100
+
+TOTAL_FIELDS = ['distance', 'duration', 'point_count', 'started_at', 'ended_at', 'last_lat', 'last_lon']
+
 
 def calc_calories(distance, duration, weight):
     if not weight:
@@ -67,8 +303,16 @@ def calc_calories(distance, duration, weight):
     return met * weight * hours
 
 
+@receiver(post_delete, sender=Run)
+def run_tombstone(sender, instance, **kwargs):
+    Tombstone.objects.create(kind=Tombstone.RUN, object_id=instance.pk, user_id=instance.user_id)
+
+
 @receiver(pre_save, sender=Run)
-def set_calories(sender, instance, **kwargs):
+def set_calories(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and 'calories' not in update_fields:
+        # Not being saved anyway; skips loading the user on every point ingest
+        return
     if instance.calories in (None, 0):
         weight = instance.user.weight
         instance.calories = round(calc_calories(instance.distance, instance.duration, weight), 1)
@@ -78,8 +322,119 @@ class RunLocation(models.Model):
     run = models.ForeignKey(Run, on_delete=models.CASCADE, related_name='locations')
     lat = models.FloatField()
     lon = models.FloatField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['run', 'timestamp']),
+        ]
 
     def __str__(self):
         user = self.run.user.username if self.run.user and self.run.user.is_authenticated else "unknown"
         return f"{user} | {self.lat}, {self.lon}"
+
+
+class RunTrack(models.Model):
+    run = models.OneToOneField(Run, on_delete=models.CASCADE, related_name='track')
+    data = models.BinaryField()
+    point_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.run} | {self.point_count} points, {len(self.data)} bytes"
+
+
+class HeatCell(models.Model):
+    # Point count of one cell of a web mercator tile at one of settings.HEATMAP_ZOOMS.
+    # Rows with user=None hold the totals over all users.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='heat_cells')
+    zoom = models.PositiveSmallIntegerField()
+    tile_x = models.PositiveIntegerField()
+    tile_y = models.PositiveIntegerField()
+    cell = models.PositiveSmallIntegerField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['zoom', 'tile_x', 'tile_y', 'cell'],
+                condition=models.Q(user__isnull=True), name='unique_heat_cell',
+            ),
+            models.UniqueConstraint(
+                fields=['user', 'zoom', 'tile_x', 'tile_y', 'cell'],
+                condition=models.Q(user__isnull=False), name='unique_user_heat_cell',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user or 'all'} | {self.zoom}/{self.tile_x}/{self.tile_y} #{self.cell}: {self.count}"
+
+
+class Tombstone(models.Model):
+    # Records deletions for /sync/. Territory tombstones have no user, everyone syncs them.
+    # user_id isn't a foreign key: the tombstones of a deleted user's runs outlive the user.
+    RUN, TERRITORY = 'run', 'territory'
+    KIND_CHOICES = [(RUN, 'Run'), (TERRITORY, 'Territory')]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    user_id = models.BigIntegerField(null=True, blank=True)
+    deleted_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.kind} #{self.object_id} deleted {self.deleted_at}"
+
+
+class Job(models.Model):
+    # Background work run by app.jobs.runner, the table doubles as the queue
+    QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='jobs')
+    kind = models.CharField(max_length=50)
+    # Identifies the work; a second enqueue with the same key returns the existing job
+    key = models.CharField(max_length=200)
+    args = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['key'], condition=~models.Q(status='failed'), name='unique_job_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} | {self.status}"
+
+
+class UserStat(models.Model):
+    PERIOD_CHOICES = [('day', 'Day'), ('week', 'Week'), ('month', 'Month')]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='stats')
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES)
+    period_start = models.DateField()
+    distance = models.FloatField(default=0)
+    duration = models.PositiveIntegerField(default=0)
+    calories = models.FloatField(default=0)
+    run_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['period', 'period_start', '-distance']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'period', 'period_start'], name='unique_user_period_stat')
+        ]
+
+    def __str__(self):
+        return f"{self.user} | {self.period} {self.period_start} | {self.distance}m"
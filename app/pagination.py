@@ -0,0 +1,160 @@
+import base64
+import binascii
+import json
+from functools import reduce
+from itertools import islice
+from operator import or_
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over a composite ordering, e.g. ('-date', '-id').
+
+    The cursor holds the ordering values of the last row on the page, and the next page
+    is fetched with a lexicographic "after this row" filter, so deep pages cost the same
+    as the first one. Views pick the ordering with a `cursor_ordering` attribute whose
+    last field must be unique. Besides querysets and lists it pages a function of the
+    position (None on the first page) that yields the rows after it in order.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = api_settings.PAGE_SIZE or 50
+    max_page_size = 500
+    default_ordering = ('-id',)
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = tuple(getattr(view, 'cursor_ordering', self.default_ordering))
+        self.page_size = self.get_page_size(request)
+        position = self.decode_cursor(request)
+
+        if isinstance(queryset, list):
+            page = self._paginate_list(queryset, position)
+        elif callable(queryset):
+            if position is not None:
+                position = self._to_python(view.queryset.model, position)
+            page = list(islice(queryset(position), self.page_size + 1))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+            if position is not None:
+                queryset = queryset.filter(self._after(queryset.model, position))
+            page = list(queryset[:self.page_size + 1])
+
+        self.has_next = len(page) > self.page_size
+        page = page[:self.page_size]
+        self.next_position = self._key(page[-1]) if self.has_next else None
+        return page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def encode_cursor(self, position):
+        # isoformat() keeps microseconds, which DjangoJSONEncoder would truncate
+        position = [value.isoformat() if hasattr(value, 'isoformat') else value for value in position]
+        data = json.dumps(position, separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)))
+        except (binascii.Error, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def _fields(self):
+        return [(name.lstrip('-'), name.startswith('-')) for name in self.ordering]
+
+    def _key(self, obj):
+        return [_value(obj, name) for name, _ in self._fields()]
+
+    def _to_python(self, model, position):
+        values = []
+        for (name, _), value in zip(self._fields(), position):
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                values.append(value)
+                continue
+            try:
+                values.append(field.to_python(value))
+            except Exception:
+                raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def _after(self, model, position):
+        # (a, b, c) > (x, y, z)  ==  a > x | (a = x & b > y) | (a = x & b = y & c > z)
+        fields = self._fields()
+        values = self._to_python(model, position)
+        branches = []
+        for i, (name, descending) in enumerate(fields):
+            equal = {fields[j][0]: values[j] for j in range(i)}
+            lookup = 'lt' if descending else 'gt'
+            branches.append(Q(**equal, **{f'{name}__{lookup}': values[i]}))
+        return reduce(or_, branches)
+
+    def _paginate_list(self, items, position):
+        fields = self._fields()
+        for name, descending in reversed(fields):
+            items = sorted(items, key=lambda obj: _value(obj, name), reverse=descending)
+        if position is None or not items:
+            return items[:self.page_size + 1]
+
+        values = self._to_python(type(items[0]), position)
+
+        def after(obj):
+            for (name, descending), value in zip(fields, values):
+                current = _value(obj, name)
+                if current != value:
+                    return current < value if descending else current > value
+            return False
+
+        return [obj for obj in items if after(obj)][:self.page_size + 1]
+
+
+def _value(obj, name):
+    # Foreign keys compare by their raw id, without loading the related row
+    try:
+        name = obj._meta.get_field(name).attname
+    except FieldDoesNotExist:
+        pass
+    return getattr(obj, name)
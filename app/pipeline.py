@@ -0,0 +1,149 @@
+from collections import deque
+from functools import lru_cache
+
+import numpy as np
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from app import geo
+
+MEASURE_CHUNK = 2048
+SPLIT_METERS = 1000
+# Slower than this (m/s) counts as standing, not moving
+MOVING_SPEED = 0.5
+
+
+def dedupe(points):
+    """Drop fixes that don't move forward in time (repeats and out of order fixes)."""
+    last = None
+    for point in points:
+        if last is None or point[2] > last:
+            last = point[2]
+            yield point
+
+
+def drop_speed_outliers(points, max_speed=12.0, max_skipped=5):
+    """
+    Drop fixes that would need more than `max_speed` m/s from the last kept fix. After
+    `max_skipped` drops in a row the track is taken to have really moved (e.g. a long
+    signal loss) and the next fix is kept.
+    """
+    last, skipped = None, 0
+    for point in points:
+        if last is not None and skipped < max_skipped:
+            elapsed = point[2] - last[2]
+            if geo.haversine(last[0], last[1], point[0], point[1]) > max_speed * elapsed:
+                skipped += 1
+                continue
+        last, skipped = point, 0
+        yield point
+
+
+def smooth(points, window=3):
+    """Moving average of the position over the last `window` fixes."""
+    lats, lons = deque(maxlen=window), deque(maxlen=window)
+    for lat, lon, seconds in points:
+        lats.append(lat)
+        lons.append(lon)
+        yield sum(lats) / len(lats), sum(lons) / len(lons), seconds
+
+
+def drop_jitter(points, min_distance=2.0):
+    """
+    Drop fixes less than `min_distance` meters from the last kept one, the wandering of
+    a receiver standing still. The final fix is always kept so the duration is unchanged.
+    """
+    last = pending = None
+    for point in points:
+        if last is not None and geo.haversine(last[0], last[1], point[0], point[1]) < min_distance:
+            pending = point
+            continue
+        last, pending = point, None
+        yield point
+    if pending is not None:
+        yield pending
+
+
+@lru_cache(maxsize=None)
+def _stages(config):
+    return [(import_string(path), dict(options)) for path, options in config]
+
+
+def build(points, config=None):
+    """
+    Chain the stages of settings.TRACK_PIPELINE, (dotted path, options) pairs, over
+    (lat, lon, timestamp or seconds) points. Stages are generators over (lat, lon, seconds)
+    tuples, so the track streams through without being held in memory.
+    """
+    if config is None:
+        config = settings.TRACK_PIPELINE
+    key = tuple((path, tuple(sorted(options.items()))) for path, options in config)
+
+    points = (
+        (lat, lon, ts if isinstance(ts, (int, float)) else ts.timestamp())
+        for lat, lon, ts in points
+    )
+    for stage, options in _stages(key):
+        points = stage(points, **options)
+    return points
+
+
+def measure(points, config=None):
+    """
+    Measure a track after the pipeline in one pass: returns (distance in meters, duration
+    in seconds, summary). The summary holds the splits as [meters, seconds] pairs, one per
+    SPLIT_METERS with the last one partial, best_pace (seconds of the fastest full split),
+    max_speed (m/s) and moving_time (seconds spent above MOVING_SPEED).
+    """
+    totals = {'distance': 0.0, 'moving_time': 0.0, 'max_speed': 0.0}
+    first = last = split_start = None
+    splits = []
+    chunk = []
+
+    def flush():
+        nonlocal last, split_start
+        track = np.array(([last] if last is not None else []) + chunk, dtype=float)
+        last = chunk[-1]
+        chunk.clear()
+        if len(track) < 2:
+            return
+
+        segments = geo.segment_distances(track[:, 0], track[:, 1])
+        elapsed = np.diff(track[:, 2])
+        speed = np.divide(segments, elapsed, out=np.zeros_like(segments), where=elapsed > 0)
+        totals['moving_time'] += float(elapsed[speed >= MOVING_SPEED].sum())
+        totals['max_speed'] = max(totals['max_speed'], float(speed.max()))
+
+        # Split boundaries crossed in this chunk, timed by interpolating inside the segment
+        covered = totals['distance'] + np.cumsum(segments)
+        for k in range(int(totals['distance'] // SPLIT_METERS) + 1, int(covered[-1] // SPLIT_METERS) + 1):
+            i = int(np.searchsorted(covered, k * SPLIT_METERS))
+            fraction = (k * SPLIT_METERS - (covered[i] - segments[i])) / segments[i]
+            at = float(track[i, 2] + fraction * elapsed[i])
+            splits.append([SPLIT_METERS, round(at - split_start, 1)])
+            split_start = at
+        totals['distance'] = float(covered[-1])
+
+    for point in build(points, config):
+        if first is None:
+            first = point
+            split_start = point[2]
+        chunk.append(point)
+        if len(chunk) >= MEASURE_CHUNK:
+            flush()
+    if chunk:
+        flush()
+
+    if first is None:
+        return 0.0, 0, None
+    rest = totals['distance'] - len(splits) * SPLIT_METERS
+    if rest >= 1:
+        splits.append([round(rest, 1), round(last[2] - split_start, 1)])
+    full = [seconds for meters, seconds in splits if meters == SPLIT_METERS]
+    summary = {
+        'splits': splits,
+        'best_pace': min(full) if full else None,
+        'max_speed': round(totals['max_speed'], 2),
+        'moving_time': int(totals['moving_time']),
+    }
+    return totals['distance'], int(last[2] - first[2]), summary
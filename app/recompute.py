@@ -0,0 +1,108 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+import numpy as np
+from django.utils import timezone
+
+from app.models import Run, RunLocation, calc_calories
+from app.pipeline import measure
+from app.track import unpack_track
+
+UPDATE_FIELDS = ['distance', 'duration', 'calories', 'point_count', 'summary', 'updated_at']
+
+
+def compute_metrics(tracks):
+    # Runs in pool workers: plain arrays in, plain values out, no database access
+    results = []
+    for run_id, weight, lats, lons, seconds in tracks:
+        if len(seconds) < 2:
+            results.append((run_id, 0.0, 0, 0.0, len(seconds), None))
+            continue
+        distance, duration, summary = measure(zip(lats.tolist(), lons.tolist(), seconds.tolist()))
+        distance = round(distance, 2)
+        calories = round(calc_calories(distance, duration, weight), 1)
+        results.append((run_id, distance, duration, calories, len(seconds), summary))
+    return results
+
+
+def load_tracks(runs):
+    """Arrays for a chunk of (run_id, weight, track_packed, packed_data) rows, in one streamed query."""
+    points = {run_id: ([], [], []) for run_id, _, packed, _ in runs if not packed}
+    rows = (
+        RunLocation.objects.filter(run_id__in=list(points))
+        .order_by('run_id', 'timestamp')
+        .values_list('run_id', 'lat', 'lon', 'timestamp')
+    )
+    for run_id, lat, lon, ts in rows.iterator(chunk_size=5000):
+        lats, lons, seconds = points[run_id]
+        lats.append(lat)
+        lons.append(lon)
+        seconds.append(ts.timestamp())
+
+    tracks = []
+    for run_id, weight, packed, data in runs:
+        if packed:
+            lats, lons, timestamps = unpack_track(data)
+            seconds = [ts.timestamp() for ts in timestamps]
+        else:
+            lats, lons, seconds = points[run_id]
+        tracks.append((run_id, weight, np.array(lats), np.array(lons), np.array(seconds)))
+    return tracks
+
+
+def iter_run_chunks(queryset, chunk_size):
+    chunk = []
+    rows = queryset.order_by('id').values_list('id', 'user__weight', 'track_packed', 'track__data')
+    for row in rows.iterator(chunk_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def recompute_runs(queryset, chunk_size=200, workers=None, on_chunk=None):
+    """
+    Recompute distance, duration, calories and the summary of every run in `queryset`,
+    ordered by id.
+
+    Chunks of runs are read while earlier chunks are being computed in a process pool,
+    results are written back with bulk_update in chunk order, and `on_chunk(last_run_id,
+    done)` is called after each write so callers can report progress and checkpoint.
+    """
+    # Workers import this module (and so app.models) when they unpickle a task; django.setup
+    # makes that work under the spawn/forkserver start methods as well as fork
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=django.setup) if workers != 1 else None
+    in_flight = deque()
+    done = 0
+
+    def write(future, last_id, size):
+        nonlocal done
+        results = future.result() if pool else future
+        now = timezone.now()
+        Run.objects.bulk_update(
+            [Run(id=run_id, distance=distance, duration=duration, calories=calories, point_count=count,
+                 summary=summary, updated_at=now)
+             for run_id, distance, duration, calories, count, summary in results],
+            UPDATE_FIELDS,
+        )
+        done += size
+        if on_chunk:
+            on_chunk(last_id, done)
+
+    try:
+        for chunk in iter_run_chunks(queryset, chunk_size):
+            tracks = load_tracks(chunk)
+            result = pool.submit(compute_metrics, tracks) if pool else compute_metrics(tracks)
+            in_flight.append((result, chunk[-1][0], len(chunk)))
+            # Keep the pool busy but bound the memory held by pending chunks
+            while len(in_flight) > (workers or 4) * 2 or (not pool and in_flight):
+                write(*in_flight.popleft())
+        while in_flight:
+            write(*in_flight.popleft())
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+    return done
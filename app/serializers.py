@@ -1,11 +1,17 @@
+import math
 from datetime import date
 
+from django.conf import settings
 from rest_framework import serializers
-from .models import User, Territory, Run, RunLocation
+from .models import Job, User, Territory, Run, RunLocation, UserStat
 
 from dj_rest_auth.registration.serializers import RegisterSerializer as DefaultRegisterSerializer
 
 
+def include_summary(request):
+    return request is not None and 'summary' in request.query_params.get('include', '').split(',')
+
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -24,8 +30,14 @@ class TerritorySerializer(serializers.ModelSerializer):
 class RunSerializer(serializers.ModelSerializer):
     class Meta:
         model = Run
-        fields = ['id', 'date', 'distance', 'duration', 'calories', 'territory', 'created_at']
-        read_only_fields = ['distance', 'duration', 'calories', 'territory', 'created_at']
+        fields = ['id', 'date', 'distance', 'duration', 'calories', 'territory', 'summary', 'created_at']
+        read_only_fields = ['distance', 'duration', 'calories', 'territory', 'summary', 'created_at']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # The summary is opt-in: ?include=summary
+        if not include_summary(self.context.get('request')):
+            self.fields.pop('summary')
 
     def create(self, validated_data):
         user = self.context['request'].user
@@ -45,6 +57,47 @@ class RunLocationSerializer(serializers.ModelSerializer):
         fields = ['id', 'run', 'lat', 'lon', 'timestamp']
 
 
+class FiniteFloatField(serializers.FloatField):
+    # FloatField accepts "nan" and "inf", and NaN slips past min_value/max_value
+    default_error_messages = {'non_finite': 'A finite number is required.'}
+
+    def to_internal_value(self, data):
+        value = super().to_internal_value(data)
+        if not math.isfinite(value):
+            self.fail('non_finite')
+        return value
+
+
+class LocationPointSerializer(serializers.Serializer):
+    lat = FiniteFloatField(min_value=-90, max_value=90)
+    lon = FiniteFloatField(min_value=-180, max_value=180)
+    ts = serializers.DateTimeField()
+
+
+class LocationBatchSerializer(serializers.Serializer):
+    points = LocationPointSerializer(many=True, allow_empty=False, max_length=settings.RUN_LOCATION_BATCH_MAX)
+
+    def to_internal_value(self, data):
+        # The client may post the bare array instead of {"points": [...]}
+        if isinstance(data, list):
+            data = {'points': data}
+        return super().to_internal_value(data)
+
+
+class UserStatSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UserStat
+        fields = ['period', 'period_start', 'distance', 'duration', 'calories', 'run_count']
+
+
+class LeaderboardSerializer(serializers.ModelSerializer):
+    username = serializers.ReadOnlyField(source='user.username')
+
+    class Meta:
+        model = UserStat
+        fields = ['user', 'username', 'distance', 'duration', 'calories', 'run_count']
+
+
 class RegisterSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
 
@@ -67,3 +120,10 @@ class AuthRegisterSerializer(DefaultRegisterSerializer):
     class Meta(DefaultRegisterSerializer):
         class Meta:
             ref_name = "AuthRegisterSerializer"
+
+
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = ['id', 'kind', 'status', 'attempts', 'result', 'error', 'created_at', 'finished_at']
+        read_only_fields = fields
@@ -0,0 +1,101 @@
+import math
+
+import numpy as np
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import ASin, Cos, Power, Radians, Sin, Sqrt
+
+from app.geo import EARTH_RADIUS
+
+# Fixed lat/lon grid used to index territories. Cell ids are stored in the
+# database, so changing the cell size means re-saving every Territory.
+CELL_DEGREES = 0.01  # ~1.1 km north-south
+ROWS = math.ceil(180 / CELL_DEGREES)
+COLS = math.ceil(360 / CELL_DEGREES)
+
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+# Above this many grid rows a cell lookup stops being selective, plain range filters are used instead
+MAX_CELL_ROWS = 200
+
+
+def _row(lat):
+    return min(max(int((lat + 90) // CELL_DEGREES), 0), ROWS - 1)
+
+
+def _col(lon):
+    return int(((lon + 180) % 360) // CELL_DEGREES)
+
+
+def cell_for(lat, lon):
+    return _row(lat) * COLS + _col(lon)
+
+
+def cell_array(lats, lons):
+    rows = np.clip((np.asarray(lats) + 90) // CELL_DEGREES, 0, ROWS - 1).astype(np.int64)
+    cols = ((np.asarray(lons) + 180) % 360 // CELL_DEGREES).astype(np.int64)
+    return rows * COLS + cols
+
+
+def cell_pad(lat, meters):
+    # How many cells (rows, cols) around a cell at `lat` are needed to reach `meters` away
+    cell_meters = CELL_DEGREES * METERS_PER_DEGREE
+    coslat = max(math.cos(math.radians(min(abs(lat) + CELL_DEGREES, 90))), 0.01)
+    return math.ceil(meters / cell_meters), min(math.ceil(meters / (cell_meters * coslat)), COLS // 2)
+
+
+def neighbor_cells(cell, pad_rows, pad_cols):
+    row, col = divmod(int(cell), COLS)
+    return [
+        r * COLS + c % COLS
+        for r in range(max(row - pad_rows, 0), min(row + pad_rows, ROWS - 1) + 1)
+        for c in range(col - pad_cols, col + pad_cols + 1)
+    ]
+
+
+def bbox_around(lat, lon, radius):
+    # (min_lat, min_lon, max_lat, max_lon) enclosing a circle of `radius` meters
+    dlat = radius / METERS_PER_DEGREE
+    coslat = math.cos(math.radians(min(abs(lat) + dlat, 89.9)))
+    dlon = min(radius / (METERS_PER_DEGREE * coslat), 180)
+    return max(lat - dlat, -90), lon - dlon, min(lat + dlat, 90), lon + dlon
+
+
+def cell_ranges(min_lat, min_lon, max_lat, max_lon):
+    """Contiguous (first, last) cell id ranges covering the box, one or two per grid row."""
+    if max_lon - min_lon >= 360:
+        col_spans = [(0, COLS - 1)]
+    else:
+        first, last = _col(min_lon), _col(max_lon)
+        # A box crossing the antimeridian wraps around to the first column
+        col_spans = [(first, last)] if first <= last else [(first, COLS - 1), (0, last)]
+
+    return [
+        (row * COLS + c0, row * COLS + c1)
+        for row in range(_row(min_lat), _row(max_lat) + 1)
+        for c0, c1 in col_spans
+    ]
+
+
+def cell_filter(min_lat, min_lon, max_lat, max_lon, field='cell'):
+    if _row(max_lat) - _row(min_lat) >= MAX_CELL_ROWS:
+        return Q()
+
+    q = Q()
+    for first, last in cell_ranges(min_lat, min_lon, max_lat, max_lon):
+        q |= Q(**{f'{field}__range': (first, last)})
+    return q
+
+
+def bbox_filter(min_lat, min_lon, max_lat, max_lon):
+    # Territories inside the box: narrowed by grid cell through the index, then exact
+    q = cell_filter(min_lat, min_lon, max_lat, max_lon) & Q(center_lat__range=(min_lat, max_lat))
+    if min_lon <= max_lon:
+        return q & Q(center_lon__range=(min_lon, max_lon))
+    return q & (Q(center_lon__gte=min_lon) | Q(center_lon__lte=max_lon))
+
+
+def distance_expression(lat, lon, lat_field='center_lat', lon_field='center_lon'):
+    # Haversine distance in meters from (lat, lon) to the row's coordinates, evaluated in SQL
+    dlat = Radians(F(lat_field) - Value(lat)) / 2
+    dlon = Radians(F(lon_field) - Value(lon)) / 2
+    a = Power(Sin(dlat), 2) + Value(math.cos(math.radians(lat))) * Cos(Radians(F(lat_field))) * Power(Sin(dlon), 2)
+    return Value(2 * EARTH_RADIUS, output_field=FloatField()) * ASin(Sqrt(a))
@@ -0,0 +1,69 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+
+from app.models import Run, UserStat
+
+PERIODS = ('day', 'week', 'month')
+METRICS = ('distance', 'duration', 'calories', 'run_count')
+
+
+def period_start(period, day):
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def record_run(run):
+    # A user has at most one run per date, so the day row holds exactly what this run
+    # contributed last time it was finished. The difference is added to all buckets,
+    # which keeps re-finishing a run (after more points came in) from counting it twice.
+    with transaction.atomic():
+        day, _ = UserStat.objects.select_for_update().get_or_create(
+            user_id=run.user_id, period='day', period_start=run.date
+        )
+        delta = {
+            'distance': run.distance - day.distance,
+            'duration': run.duration - day.duration,
+            'calories': (run.calories or 0) - day.calories,
+            'run_count': 1 - day.run_count,
+        }
+        if not any(delta.values()):
+            return
+
+        for period in PERIODS:
+            start = period_start(period, run.date)
+            if period != 'day':
+                UserStat.objects.get_or_create(user_id=run.user_id, period=period, period_start=start)
+            UserStat.objects.filter(user_id=run.user_id, period=period, period_start=start).update(
+                **{metric: F(metric) + value for metric, value in delta.items()}
+            )
+
+
+def rebuild_stats(chunk_size=2000):
+    totals = defaultdict(lambda: dict.fromkeys(METRICS, 0))
+    runs = (
+        Run.objects.filter(finished_at__isnull=False)
+        .order_by()
+        .values_list('user_id', 'date', 'distance', 'duration', 'calories')
+    )
+    for user_id, date, distance, duration, calories in runs.iterator(chunk_size=chunk_size):
+        for period in PERIODS:
+            row = totals[(user_id, period, period_start(period, date))]
+            row['distance'] += distance
+            row['duration'] += duration
+            row['calories'] += calories or 0
+            row['run_count'] += 1
+
+    with transaction.atomic():
+        UserStat.objects.all().delete()
+        UserStat.objects.bulk_create(
+            (UserStat(user_id=user_id, period=period, period_start=start, **values)
+             for (user_id, period, start), values in totals.items()),
+            batch_size=chunk_size,
+        )
+    return len(totals)
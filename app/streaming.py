@@ -0,0 +1,256 @@
+import asyncio
+import json
+import re
+import time
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+from app.authentication import CachedJWTAuthentication
+from app.live import can_follow, feed
+from app.models import Run
+from app.serializers import LocationPointSerializer
+
+# POST /runs/<id>/stream/ with a newline-delimited JSON body, one {lat, lon, ts} per line
+STREAM_PATH = re.compile(r'^/runs/(?P<run_id>\d+)/stream/?$')
+# GET /runs/<id>/live/ with "Accept: text/event-stream"
+LIVE_PATH = re.compile(r'^/runs/(?P<run_id>\d+)/live/?$')
+MAX_LINE_BYTES = 64 * 1024
+MAX_REPORTED_ERRORS = 20
+
+
+class StreamingIngestApp:
+    """
+    Raw ASGI app for long-lived point uploads.
+
+    Django's ASGI handler reads the whole request body before calling a view, so this
+    sits in front of it and consumes the body chunk by chunk. Points are parsed as lines
+    complete and flushed through Run.add_points every STREAM_INGEST_FLUSH_POINTS points or
+    STREAM_INGEST_FLUSH_SECONDS, so a slow uploader holds a coroutine, not a worker.
+    """
+
+    def __init__(self, django_app):
+        self.django_app = django_app
+
+    async def __call__(self, scope, receive, send):
+        match = STREAM_PATH.match(scope['path']) if scope['type'] == 'http' else None
+        if match is None:
+            return await self.django_app(scope, receive, send)
+
+        if scope['method'] != 'POST':
+            return await respond(send, 405, {'detail': f'Method "{scope["method"]}" not allowed.'})
+
+        await sync_to_async(close_old_connections)()
+        try:
+            run = await sync_to_async(authorize)(scope, int(match['run_id']))
+            await respond(send, 200, await StreamIngest(run).consume(receive))
+        except StreamRejected as exc:
+            await respond(send, exc.status, {'detail': exc.detail})
+        finally:
+            await sync_to_async(close_old_connections)()
+
+
+class LiveFeedApp:
+    """
+    Server-sent events for following a run live, straight from the in-process app.live
+    buffer: after authorization nothing touches the database. Each event carries the
+    points after the client's cursor (?cursor= or the Last-Event-ID header EventSource
+    sends on reconnect). Only the runner, or a follower with a ?share= token, gets the
+    stream. Other requests, including plain JSON polling of the same URL, go to Django.
+    """
+
+    def __init__(self, django_app):
+        self.django_app = django_app
+
+    async def __call__(self, scope, receive, send):
+        match = LIVE_PATH.match(scope['path']) if scope['type'] == 'http' else None
+        headers = scope_headers(scope) if match else {}
+        if match is None or scope['method'] != 'GET' or 'text/event-stream' not in headers.get('accept', ''):
+            return await self.django_app(scope, receive, send)
+
+        query = parse_qs(scope.get('query_string', b'').decode('latin1'))
+        run_id = int(match['run_id'])
+        try:
+            await sync_to_async(authorize_follow)(headers, run_id, query.get('share', [None])[0])
+        except StreamRejected as exc:
+            return await respond(send, exc.status, {'detail': exc.detail})
+        finally:
+            await sync_to_async(close_old_connections)()
+
+        cursor = headers.get('last-event-id') or query.get('cursor', ['0'])[0]
+        cursor = int(cursor) if cursor.isdigit() else 0
+
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        disconnected = asyncio.ensure_future(wait_disconnect(receive))
+        try:
+            await self.follow(send, run_id, cursor, disconnected)
+        finally:
+            disconnected.cancel()
+
+    async def follow(self, send, run_id, cursor, disconnected):
+        deadline = time.monotonic() + settings.LIVE_STREAM_SECONDS
+        last_sent = time.monotonic()
+        while not disconnected.done() and time.monotonic() < deadline:
+            update = feed.since(run_id, cursor)
+            if update and (update['points'] or update['reset'] or update['finished']):
+                cursor = update['cursor']
+                event = 'finished' if update['finished'] else 'points'
+                data = json.dumps({'run': run_id, **update}, cls=DjangoJSONEncoder)
+                await send({'type': 'http.response.body', 'body': f'id: {cursor}\nevent: {event}\ndata: {data}\n\n'.encode(), 'more_body': True})
+                last_sent = time.monotonic()
+                if update['finished']:
+                    break
+            elif time.monotonic() - last_sent >= settings.LIVE_KEEPALIVE_SECONDS:
+                await send({'type': 'http.response.body', 'body': b': keepalive\n\n', 'more_body': True})
+                last_sent = time.monotonic()
+            await asyncio.wait([disconnected], timeout=settings.LIVE_POLL_SECONDS)
+
+        if not disconnected.done():
+            # Past the deadline EventSource reconnects with Last-Event-ID and carries on
+            await send({'type': 'http.response.body', 'body': b''})
+
+
+class StreamRejected(Exception):
+    def __init__(self, status, detail):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+class StreamIngest:
+    def __init__(self, run):
+        self.run = run
+        self.buffer = []
+        self.last_flush = time.monotonic()
+        self.stats = {'received': 0, 'created': 0, 'rejected': 0, 'flushes': 0}
+        self.errors = []
+
+    async def consume(self, receive):
+        pending = b''
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+
+            pending += message.get('body', b'')
+            *lines, pending = pending.split(b'\n')
+            for line in lines:
+                self.parse(line)
+            if len(pending) > MAX_LINE_BYTES:
+                self.reject('line too long')
+                pending = b''
+
+            if self.should_flush():
+                await self.flush()
+            if not message.get('more_body', False):
+                self.parse(pending)
+                break
+
+        await self.flush()
+        self.stats['skipped'] = self.stats['received'] - self.stats['rejected'] - self.stats['created']
+        return {'run': self.run.id, **self.stats, 'errors': self.errors}
+
+    def parse(self, line):
+        line = line.strip()
+        if not line:
+            return
+        self.stats['received'] += 1
+        try:
+            data = json.loads(line)
+        except ValueError:
+            return self.reject('invalid JSON')
+
+        serializer = LocationPointSerializer(data=data)
+        if not serializer.is_valid():
+            return self.reject(serializer.errors)
+        self.buffer.append(serializer.validated_data)
+
+    def reject(self, error):
+        self.stats['rejected'] += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': self.stats['received'], 'error': error})
+
+    def should_flush(self):
+        return self.buffer and (
+            len(self.buffer) >= settings.STREAM_INGEST_FLUSH_POINTS
+            or time.monotonic() - self.last_flush >= settings.STREAM_INGEST_FLUSH_SECONDS
+        )
+
+    async def flush(self):
+        points, self.buffer = self.buffer, []
+        self.last_flush = time.monotonic()
+        if not points:
+            return
+        feed.publish(self.run.id, self.run.user_id, points)
+        created = await sync_to_async(self.run.add_points)(points)
+        self.stats['created'] += len(created)
+        self.stats['flushes'] += 1
+
+
+def scope_headers(scope):
+    return {name.decode('latin1').lower(): value.decode('latin1') for name, value in scope['headers']}
+
+
+def authenticate(headers):
+    raw_token = None
+    if headers.get('authorization', '').startswith('Bearer '):
+        raw_token = headers['authorization'][len('Bearer '):]
+    else:
+        for cookie in headers.get('cookie', '').split(';'):
+            name, _, value = cookie.strip().partition('=')
+            if name == settings.JWT_AUTH_COOKIE:
+                raw_token = value
+    if not raw_token:
+        raise StreamRejected(401, 'Authentication credentials were not provided.')
+
+    auth = CachedJWTAuthentication()
+    try:
+        return auth.get_user(auth.get_validated_token(raw_token))
+    except (InvalidToken, AuthenticationFailed) as exc:
+        raise StreamRejected(401, exc.detail)
+
+
+def authorize(scope, run_id):
+    user = authenticate(scope_headers(scope))
+    run = Run.objects.filter(id=run_id, user=user).first()
+    if run is None:
+        raise StreamRejected(403, "You can't attach location to another user's run.")
+    return run
+
+
+def authorize_follow(headers, run_id, share):
+    user = authenticate(headers)
+    # A run that isn't live yet can be waited for, so fall back to the database for its owner
+    owner = feed.owner(run_id)
+    if owner is None:
+        owner = Run.objects.filter(id=run_id).values_list('user_id', flat=True).first()
+    if owner is None or not can_follow(run_id, owner, user.pk, share):
+        raise StreamRejected(404, 'Not found.')
+
+
+async def wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def respond(send, status, data):
+    body = json.dumps(data, default=str).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,96 @@
+import base64
+import binascii
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from app import spatial
+from app.models import Run, Territory, Tombstone
+
+STREAMS = ('runs', 'territories', 'deleted', 'profile')
+
+
+def encode_token(positions):
+    data = {
+        name: [position[0].isoformat(), position[1]] if position else None
+        for name, position in positions.items()
+    }
+    return base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_token(token):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        positions = {}
+        for name in STREAMS:
+            moment, pk = data[name]
+            moment = parse_datetime(moment)
+            if moment is None or timezone.is_naive(moment) or not isinstance(pk, int):
+                raise ValueError
+            positions[name] = (moment, pk)
+    except (binascii.Error, TypeError, KeyError, ValueError):
+        raise ValueError("Invalid sync token")
+    return positions
+
+
+def _after(position, time_field):
+    # Rows after (time, id) in (time_field, id) order
+    if position is None:
+        return Q()
+    moment, pk = position
+    return Q(**{f'{time_field}__gt': moment}) | Q(**{time_field: moment, 'id__gt': pk})
+
+
+def _page(queryset, position, time_field, size):
+    rows = list(queryset.filter(_after(position, time_field)).order_by(time_field, 'id')[:size + 1])
+    return rows[:size], len(rows) > size
+
+
+def changes(user, positions=None, bbox=None):
+    """
+    One page of what changed for `user` after the sync token positions (everything on
+    the first sync): runs of the user, territories (inside `bbox` if given), the profile
+    and the ids deleted. Each list holds at most SYNC_PAGE_SIZE rows; `has_more` says the
+    client should call again with the new token straight away.
+
+    Every list is read in (updated_at, id) order and the token keeps the position of each
+    one, so a page picks up exactly where the last one stopped. Once a list is exhausted
+    its position moves to SYNC_OVERLAP_SECONDS before now: updated_at is set when a row is
+    saved but only becomes visible when its transaction commits, so rows that commit late
+    are picked up by the next sync, at the cost of sending recent changes twice.
+    """
+    positions = positions or dict.fromkeys(STREAMS)
+    horizon = (timezone.now() - timedelta(seconds=settings.SYNC_OVERLAP_SECONDS), 0)
+    size = settings.SYNC_PAGE_SIZE
+
+    territories = Territory.objects.select_related('owner')
+    if bbox is not None:
+        territories = territories.filter(spatial.bbox_filter(*bbox))
+    tombstones = Tombstone.objects.filter(Q(kind=Tombstone.TERRITORY) | Q(kind=Tombstone.RUN, user_id=user.pk))
+    pages = {
+        'runs': _page(Run.objects.filter(user=user).defer('summary'), positions['runs'], 'updated_at', size),
+        'territories': _page(territories, positions['territories'], 'updated_at', size),
+        'deleted': _page(tombstones, positions['deleted'], 'deleted_at', size),
+    }
+
+    new_positions = {'profile': horizon}
+    for name, (rows, more) in pages.items():
+        time_field = 'deleted_at' if name == 'deleted' else 'updated_at'
+        new_positions[name] = (getattr(rows[-1], time_field), rows[-1].id) if more else horizon
+
+    profile = positions['profile']
+    deleted = {Tombstone.RUN: [], Tombstone.TERRITORY: []}
+    for tombstone in pages['deleted'][0]:
+        deleted[tombstone.kind].append(tombstone.object_id)
+    return {
+        'token': encode_token(new_positions),
+        'has_more': any(more for _, more in pages.values()),
+        'runs': pages['runs'][0],
+        'territories': pages['territories'][0],
+        'profile': user if profile is None or user.updated_at > profile[0] else None,
+        'deleted': {'runs': deleted[Tombstone.RUN], 'territories': deleted[Tombstone.TERRITORY]},
+    }
@@ -0,0 +1,41 @@
+from django.db import transaction
+from django.utils import timezone
+
+from app.capture import capture_territories
+from app.heatmap import record_heat
+from app.jobs import TaskError
+from app.models import Run, calc_calories
+from app.pipeline import measure
+from app.serializers import RunSerializer
+from app.stats import record_run
+
+
+def finish_run(run_id):
+    # Post-processing of POST /runs/<id>/finish/, run as a job (app.jobs)
+    run = Run.objects.select_related('user').get(id=run_id)
+    if run.track_simplified:
+        # Totals and stats were measured on the full track, the thinned one would lower
+        # them (recompute_runs skips these runs for the same reason)
+        data = RunSerializer(run).data
+        data['summary'] = run.summary
+        return data
+    if not run.point_count:
+        # Track was stored before running totals existed
+        run.recompute_totals()
+    if run.point_count < 2:
+        raise TaskError("Not enough points to calculate distance")
+
+    distance, run.duration, run.summary = measure(run.iter_track())
+    run.distance = round(distance, 2)
+    run.calories = calc_calories(run.distance, run.duration, run.user.weight)
+    run.finished_at = timezone.now()
+    with transaction.atomic():
+        run.save(update_fields=['distance', 'duration', 'calories', 'summary', 'finished_at'])
+        capture = capture_territories(run)
+        record_run(run)
+        record_heat(run)
+
+    data = RunSerializer(run).data
+    data['summary'] = run.summary
+    data['capture'] = capture
+    return data
@@ -1,3 +1,1241 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import zipfile
+import math
+import os
+import random
+import time
+from datetime import date, timedelta
+from importlib import import_module
+from tempfile import TemporaryDirectory
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.models import update_last_login
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django.core.files.uploadedfile import SimpleUploadedFile
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from app import geo, spatial
+from app.authentication import UserCache, user_cache
+from app import jobs
+from app.benchmark import Benchmark, random_walk
+from app.capture import capture_territories
+from app.heatmap import rebuild_heatmap, record_heat
+from app.importer import iter_track_points
+from app.live import feed
+from app.models import Job, Run, Territory, Tombstone, User, UserStat
+from app import pipeline
+from app.pipeline import measure
+from app.stats import rebuild_stats, record_run
+from app.streaming import StreamingIngestApp, StreamRejected, authorize_follow
+from app.tasks import finish_run
+from app.track import pack_track, unpack_track
+from app.writer import LocationWriter
+
+
+def make_points(count, start=None, lat=41.3, lon=69.2, step=2e-5):
+    # A straight track northwards, one fix per second, about 2.2 m apart
+    start = start or timezone.now().replace(microsecond=0)
+    return [
+        {'lat': lat + i * step, 'lon': lon, 'ts': start + timedelta(seconds=i)}
+        for i in range(count)
+    ]
+
+
+def as_json(points):
+    return [{'lat': p['lat'], 'lon': p['lon'], 'ts': p['ts'].isoformat()} for p in points]
+
+
+# In memory, so tests neither read nor clear the cache of a server on the same machine
+LOCAL_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(LOCATION_WRITE_BEHIND=False, JOB_RUN_INLINE=True, CACHES=LOCAL_CACHES)
+class APITestCase(TestCase):
+    def setUp(self):
+        # Ids are reused between tests, so start without the cached responses and live runs
+        # of earlier ones
+        cache.clear()
+        feed.runs.clear()
+        self.user = User.objects.create_user('runner', password='secret', weight=70, height=180)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def make_run(self, user=None, date=None, points=0):
+        run = Run.objects.create(user=user or self.user, date=date or timezone.localdate())
+        if points:
+            run.add_points(make_points(points))
+        return run
+
+
+class BatchIngestTests(APITestCase):
+    def test_points_are_stored(self):
+        run = self.make_run()
+        response = self.client.post(f'/runs/{run.id}/add_locations/', as_json(make_points(10)), format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 10)
+        self.assertEqual(run.locations.count(), 10)
+
+    def test_retried_batch_is_skipped(self):
+        run = self.make_run()
+        points = as_json(make_points(10))
+        self.client.post(f'/runs/{run.id}/add_locations/', {'points': points}, format='json')
+        response = self.client.post(f'/runs/{run.id}/add_locations/', {'points': points}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['skipped']), (0, 10))
+        self.assertEqual(run.locations.count(), 10)
+
+    def test_duplicate_timestamps_in_batch(self):
+        run = self.make_run()
+        points = as_json(make_points(5))
+        response = self.client.post(f'/runs/{run.id}/add_locations/', points + points[:2], format='json')
+        self.assertEqual((response.data['received'], response.data['created']), (7, 5))
+
+    def test_non_finite_and_out_of_range_points_are_rejected(self):
+        run = self.make_run()
+        for lat in ('nan', 'NaN', 'inf', '-inf', 500):
+            points = as_json(make_points(3))
+            points[1]['lat'] = lat
+            response = self.client.post(f'/runs/{run.id}/add_locations/', points, format='json')
+            self.assertEqual(response.status_code, 400, lat)
+        self.assertFalse(run.locations.exists())
+
+    def test_other_users_run(self):
+        other = User.objects.create_user('other', password='secret', weight=60, height=170)
+        run = self.make_run(user=other)
+        response = self.client.post(f'/runs/{run.id}/add_locations/', as_json(make_points(3)), format='json')
+        self.assertEqual(response.status_code, 404)
+
+
+class ManualWriter(LocationWriter):
+    # No background thread, the test flushes
+    def _start(self):
+        pass
+
+
+class LocationWriterTests(APITestCase):
+    def test_add_location_rejects_bad_values(self):
+        run = self.make_run()
+        for lat in ('nan', 'inf', 500, 'north'):
+            response = self.client.post(f'/runs/{run.id}/add_location/', {'lat': lat, 'lon': 69.2}, format='json')
+            self.assertEqual(response.status_code, 400, lat)
+        response = self.client.post(f'/runs/{run.id}/add_location/', {'lat': 41.3, 'lon': 69.2}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(run.locations.count(), 1)
+
+    def test_failing_run_does_not_block_others(self):
+        good, bad = self.make_run(), self.make_run(date=timezone.localdate() - timedelta(days=1))
+        writer = ManualWriter()
+        for point in make_points(5):
+            writer.add(good.id, point)
+        writer.add(bad.id, {'lat': None, 'lon': 69.2, 'ts': timezone.now()})
+
+        with self.assertLogs('app.writer', 'ERROR'):
+            self.assertEqual(writer.flush(), 5)
+        self.assertEqual(good.locations.count(), 5)
+        self.assertEqual(writer.size, 1)
+
+        with override_settings(LOCATION_WRITER_MAX_ATTEMPTS=2), self.assertLogs('app.writer', 'ERROR') as logs:
+            writer.flush()
+        self.assertIn('Dropped 1 points', logs.output[0])
+        self.assertEqual((writer.size, writer.pending, writer.failures), (0, {}, {}))
+
+    @override_settings(LOCATION_WRITE_BEHIND=True, JOB_RUN_INLINE=False)
+    def test_finish_job_waits_for_other_workers(self):
+        run = self.make_run(points=1)
+        other_worker = ManualWriter()
+        for point in make_points(4, start=run.ended_at + timedelta(seconds=1)):
+            other_worker.add(run.id, point)
+
+        requested = timezone.now()
+        response = self.client.post(f'/runs/{run.id}/finish/')
+        self.assertEqual(response.status_code, 202)
+        job = Job.objects.get(id=response.data['id'])
+        self.assertGreaterEqual(job.run_after, requested + timedelta(seconds=settings.LOCATION_WRITER_FINISH_WAIT))
+        self.assertIsNone(jobs.JobRunner().claim_next())
+
+        # The other worker's writer flushes before the job is due
+        other_worker.flush()
+        jobs.claim(job.id)
+        jobs.runner.execute(job.id)
+        job.refresh_from_db()
+        run.refresh_from_db()
+        self.assertEqual((job.status, job.result['id'], run.point_count), (Job.DONE, run.id, 5))
+        self.assertGreater(run.distance, 0)
+
+
+class FinishTests(APITestCase):
+    def test_finish_measures_the_run(self):
+        run = self.make_run(points=100)
+        response = self.client.post(f'/runs/{run.id}/finish/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], Job.DONE)
+        run.refresh_from_db()
+        self.assertIsNotNone(run.finished_at)
+        self.assertAlmostEqual(run.distance, 220, delta=5)
+        self.assertEqual(run.duration, 99)
+        self.assertGreater(run.calories, 0)
+
+    def test_not_enough_points(self):
+        run = self.make_run(points=1)
+        response = self.client.post(f'/runs/{run.id}/finish/')
+        self.assertEqual((response.status_code, response.data['status']), (400, Job.FAILED))
+        self.assertEqual(response.data['error'], "Not enough points to calculate distance")
+        self.assertEqual(response.data['attempts'], 1)
+
+    def test_finishing_again_measures_new_points(self):
+        run = self.make_run(points=100)
+        first = self.client.post(f'/runs/{run.id}/finish/').data
+        run.refresh_from_db()
+        run.add_points(make_points(50, start=run.ended_at + timedelta(seconds=1), lat=run.last_lat + 2e-5))
+        second = self.client.post(f'/runs/{run.id}/finish/').data
+        self.assertNotEqual(second['id'], first['id'])
+        self.assertGreater(second['result']['distance'], first['result']['distance'])
+
+    def test_points_ingested_while_finishing_keep_their_totals(self):
+        run = self.make_run(points=100)
+        later = make_points(50, start=run.ended_at + timedelta(seconds=1), lat=run.last_lat + 2e-5)
+
+        def measure_while_ingesting(points):
+            result = measure(points)
+            Run.objects.get(id=run.id).add_points(later)
+            return result
+
+        with mock.patch('app.tasks.measure', measure_while_ingesting):
+            finish_run(run.id)
+        run.refresh_from_db()
+        self.assertEqual(run.point_count, 150)
+        self.assertEqual(run.ended_at, later[-1]['ts'])
+        self.assertEqual(run.last_lat, later[-1]['lat'])
+        self.assertIsNotNone(run.finished_at)
+
+
+class LiveFeedTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.run = self.make_run()
+        self.other = User.objects.create_user('spectator', password='secret', weight=60, height=170)
+        self.spectator = APIClient()
+        self.spectator.force_authenticate(self.other)
+        self.client.post(f'/runs/{self.run.id}/add_locations/', as_json(make_points(3)), format='json')
+
+    def test_runner_follows_own_run(self):
+        response = self.client.get(f'/runs/{self.run.id}/live/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['cursor'], len(response.data['points'])), (3, 3))
+        self.assertEqual(len(self.client.get(f'/runs/{self.run.id}/live/?cursor=2').data['points']), 1)
+
+    def test_others_need_a_share_token(self):
+        self.assertEqual(self.spectator.get(f'/runs/{self.run.id}/live/').status_code, 404)
+        self.assertEqual(self.spectator.get(f'/runs/{self.run.id}/live/?share=forged').status_code, 404)
+        self.assertEqual(self.spectator.post(f'/runs/{self.run.id}/share_live/').status_code, 404)
+
+        share = self.client.post(f'/runs/{self.run.id}/share_live/').data['share']
+        response = self.spectator.get(f'/runs/{self.run.id}/live/', {'share': share})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['points']), 3)
+
+    def test_share_token_is_bound_to_its_run(self):
+        other_run = self.make_run(user=self.other)
+        feed.publish(other_run.id, self.other.id, make_points(1))
+        share = self.client.post(f'/runs/{self.run.id}/share_live/').data['share']
+        stranger = APIClient()
+        stranger.force_authenticate(User.objects.create_user('stranger', password='secret', weight=60, height=170))
+        self.assertEqual(stranger.get(f'/runs/{other_run.id}/live/', {'share': share}).status_code, 404)
+
+    def test_event_stream_authorization(self):
+        def headers(user):
+            return {'authorization': f'Bearer {AccessToken.for_user(user)}'}
+
+        authorize_follow(headers(self.user), self.run.id, None)
+        with self.assertRaises(StreamRejected) as rejected:
+            authorize_follow(headers(self.other), self.run.id, None)
+        self.assertEqual(rejected.exception.status, 404)
+        share = self.client.post(f'/runs/{self.run.id}/share_live/').data['share']
+        authorize_follow(headers(self.other), self.run.id, share)
+
+
+class HeatmapTests(APITestCase):
+    def tile_url(self, lat=41.3, lon=69.2, z=14):
+        n = 2 ** z
+        x = int((lon + 180) / 360 * n)
+        y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+        return f'/heatmap/{z}/{x}/{y}/'
+
+    def test_global_and_own_heatmap(self):
+        record_heat(self.make_run(points=50))
+        self.assertEqual(sum(self.client.get(self.tile_url()).data['counts']), 50)
+        self.assertEqual(sum(self.client.get(self.tile_url(), {'user': 'me'}).data['counts']), 50)
+        self.assertEqual(self.client.get(self.tile_url(), {'user': self.user.pk}).status_code, 200)
+
+    def test_points_are_counted_once(self):
+        run = self.make_run(points=50)
+        record_heat(run)
+        self.assertEqual(record_heat(run), 0)
+        run.add_points(make_points(10, start=run.ended_at + timedelta(seconds=1), lat=run.last_lat))
+        self.assertEqual(record_heat(Run.objects.get(id=run.id)), 10)
+        self.assertEqual(sum(self.client.get(self.tile_url()).data['counts']), 60)
+
+    def test_rebuild_counts_finished_runs(self):
+        self.client.post(f'/runs/{self.make_run(points=50).id}/finish/')
+        self.make_run(date=date(2025, 1, 1), points=30)
+        before = self.client.get(self.tile_url()).data
+        self.assertEqual(rebuild_heatmap(), 50)
+        self.assertEqual(self.client.get(self.tile_url()).data, before)
+
+    def test_zoomed_out_tiles_add_up(self):
+        record_heat(self.make_run(points=50))
+        for z in (14, 12, 8, 6):
+            self.assertEqual(sum(self.client.get(self.tile_url(z=z)).data['counts']), 50, z)
+        self.assertEqual(self.client.get(self.tile_url(z=2)).status_code, 400)
+
+    def test_other_users_heatmap_is_private(self):
+        other = User.objects.create_user('other', password='secret', weight=60, height=170)
+        record_heat(self.make_run(user=other, points=50))
+        self.assertEqual(self.client.get(self.tile_url(), {'user': other.pk}).status_code, 403)
+        self.assertEqual(self.client.get(self.tile_url(), {'user': 'me'}).data['counts'], [])
+
+
+class FinishedAtBackfillTests(APITestCase):
+    def test_measured_runs_of_earlier_days_are_finished(self):
+        migration = import_module('app.migrations.0013_backfill_finished_at')
+        measured = self.make_run(date=date(2025, 1, 1), points=10)
+        empty = self.make_run(date=date(2025, 1, 2))
+        today = self.make_run(points=10)
+
+        migration.fill_finished_at(apps, None)
+        for run in (measured, empty, today):
+            run.refresh_from_db()
+        self.assertEqual(measured.finished_at, measured.ended_at)
+        self.assertIsNone(empty.finished_at)
+        self.assertIsNone(today.finished_at)
+
+
+@override_settings(SYNC_OVERLAP_SECONDS=0)
+class SyncTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = User.objects.create_user('other', password='secret', weight=60, height=170)
+
+    def territory(self, owner, lat=41.3, lon=69.2):
+        return Territory.objects.create(owner=owner, center_lat=lat, center_lon=lon, radius=50)
+
+    def sync(self, **params):
+        response = self.client.get('/sync/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_full_then_delta(self):
+        run = self.make_run()
+        gone = self.make_run(date=date(2025, 1, 1))
+        self.make_run(user=self.other)
+        mine, theirs = self.territory(self.user), self.territory(self.other, lat=41.31)
+
+        full = self.sync()
+        self.assertEqual({r['id'] for r in full['runs']}, {run.id, gone.id})
+        self.assertEqual({t['id'] for t in full['territories']}, {mine.id, theirs.id})
+        self.assertEqual(full['profile']['username'], 'runner')
+        self.assertFalse(full['has_more'])
+
+        empty = self.sync(since=full['token'])
+        self.assertEqual((empty['runs'], empty['territories'], empty['profile']), ([], [], None))
+
+        run.calories = 12
+        run.save(update_fields=['calories'])
+        mine.radius = 60
+        mine.save()
+        gone_id, theirs_id = gone.id, theirs.id
+        gone.delete()
+        theirs.delete()
+        self.user.weight = 71
+        self.user.save()
+
+        delta = self.sync(since=full['token'])
+        self.assertEqual([r['id'] for r in delta['runs']], [run.id])
+        self.assertEqual([t['id'] for t in delta['territories']], [mine.id])
+        self.assertEqual(delta['profile']['weight'], 71)
+        self.assertEqual(delta['deleted'], {'runs': [gone_id], 'territories': [theirs_id]})
+
+    def test_other_users_run_deletions_are_not_sent(self):
+        full = self.sync()
+        self.make_run(user=self.other).delete()
+        self.assertEqual(Tombstone.objects.count(), 1)
+        self.assertEqual(self.sync(since=full['token'])['deleted'], {'runs': [], 'territories': []})
+
+    @override_settings(SYNC_PAGE_SIZE=2)
+    def test_pages(self):
+        ids = [self.territory(self.other, lat=41.3 + i * 0.01).id for i in range(5)]
+        seen, token, calls = [], None, 0
+        while True:
+            data = self.sync(since=token) if token else self.sync()
+            self.assertLessEqual(len(data['territories']), 2)
+            seen += [t['id'] for t in data['territories']]
+            token, calls = data['token'], calls + 1
+            if not data['has_more']:
+                break
+        self.assertEqual((seen, calls), (ids, 3))
+        self.assertEqual(self.sync(since=token)['territories'], [])
+
+    def test_bbox(self):
+        inside = self.territory(self.other)
+        self.territory(self.other, lat=10, lon=10)
+        data = self.sync(bbox='41,69,42,70')
+        self.assertEqual([t['id'] for t in data['territories']], [inside.id])
+
+    def test_invalid_token(self):
+        self.assertEqual(self.client.get('/sync/', {'since': 'garbage'}).status_code, 400)
+        self.assertEqual(self.client.get('/sync/', {'since': 'e30'}).status_code, 400)
+
+
+class RecomputeRunsTests(APITestCase):
+    def recompute(self):
+        with TemporaryDirectory() as tmp:
+            call_command('recompute_runs', workers=1, no_stats=True, checkpoint=f'{tmp}/checkpoint', stdout=io.StringIO())
+
+    def test_finished_runs_are_recomputed(self):
+        run = self.make_run(points=100)
+        self.client.post(f'/runs/{run.id}/finish/')
+        Run.objects.filter(id=run.id).update(distance=1, duration=1, calories=1)
+
+        self.recompute()
+        run.refresh_from_db()
+        self.assertAlmostEqual(run.distance, 220, delta=5)
+        self.assertEqual(run.duration, 99)
+        self.assertGreater(run.calories, 1)
+
+    def test_runs_in_progress_are_left_alone(self):
+        run = self.make_run(points=100)
+        totals = Run.objects.values('distance', 'duration', 'point_count', 'ended_at').get(id=run.id)
+
+        self.recompute()
+        self.assertEqual(Run.objects.values('distance', 'duration', 'point_count', 'ended_at').get(id=run.id), totals)
+
+
+class MetricsTests(APITestCase):
+    def test_series_are_labelled_with_the_worker(self):
+        self.client.get('/runs/')
+        body = self.client.get('/metrics/').content.decode()
+        worker = f'worker="{os.getpid()}"'
+        series = [line for line in body.splitlines() if line.startswith('runquest_')]
+        self.assertTrue(series)
+        self.assertTrue(all(worker in line for line in series))
+        self.assertIn('runquest_requests_total{' + worker, body)
+
+
+class ExportTests(APITestCase):
+    def test_formats_with_matching_accept(self):
+        run = self.make_run(points=3)
+        for fmt, accept in (('gpx', 'application/gpx+xml'), ('geojson', 'application/geo+json'), ('csv', 'text/csv')):
+            for url in (f'/runs/{run.id}/export/{fmt}/', f'/runs/export/{fmt}/'):
+                response = self.client.get(url, HTTP_ACCEPT=accept)
+                self.assertEqual(response.status_code, 200, (url, accept))
+                self.assertEqual(response['Content-Type'], accept)
+                self.assertTrue(b''.join(response.streaming_content))
+
+    def test_csv_rows(self):
+        run = self.make_run(points=3)
+        lines = b''.join(self.client.get(f'/runs/{run.id}/export/csv/').streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'run,date,timestamp,lat,lon')
+        self.assertEqual(len(lines), 4)
+
+    def test_errors_are_json(self):
+        other = User.objects.create_user('other', password='secret', weight=60, height=170)
+        run = self.make_run(user=other, points=3)
+        response = self.client.get(f'/runs/{run.id}/export/csv/', HTTP_ACCEPT='text/csv')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+
+class RunningTotalsTests(APITestCase):
+    def assertTotalsMatchTrack(self, run):
+        run.refresh_from_db()
+        lats, lons, timestamps = run.track_points()
+        self.assertEqual(run.point_count, len(timestamps))
+        self.assertAlmostEqual(run.distance, geo.track_distance(lats, lons), places=6)
+        self.assertEqual((run.started_at, run.ended_at), (timestamps[0], timestamps[-1]))
+        self.assertEqual((run.last_lat, run.last_lon), (lats[-1], lons[-1]))
+        self.assertEqual(run.duration, int((timestamps[-1] - timestamps[0]).total_seconds()))
+
+    def test_batches_extend_the_totals(self):
+        run = self.make_run()
+        points = make_points(30)
+        for i in range(0, 30, 7):
+            run.add_points(points[i:i + 7])
+        self.assertTotalsMatchTrack(run)
+        self.assertEqual(run.point_count, 30)
+
+    def test_late_points_recompute_the_totals(self):
+        run = self.make_run()
+        points = make_points(20)
+        run.add_points(points[::2])
+        run.add_points(points[1::2])
+        self.assertTotalsMatchTrack(run)
+        self.assertEqual(run.point_count, 20)
+
+    def test_finish_without_totals(self):
+        # Tracks stored before running totals existed are counted at finish
+        run = self.make_run(points=10)
+        Run.objects.filter(id=run.id).update(point_count=0, distance=0, duration=0, started_at=None, ended_at=None)
+        self.assertEqual(self.client.post(f'/runs/{run.id}/finish/').status_code, 200)
+        run.refresh_from_db()
+        self.assertEqual(run.point_count, 10)
+
+
+class GeoTests(TestCase):
+    def test_haversine_known_distance(self):
+        # One degree of latitude along a meridian
+        self.assertAlmostEqual(geo.haversine(0, 0, 1, 0), 111195, delta=1)
+        self.assertEqual(geo.haversine(41.3, 69.2, 41.3, 69.2), 0)
+
+    def test_array_matches_scalar(self):
+        rng = random.Random(1)
+        lats = [rng.uniform(-80, 80) for _ in range(50)]
+        lons = [rng.uniform(-180, 180) for _ in range(50)]
+        segments = geo.segment_distances(lats, lons)
+        for i, segment in enumerate(segments):
+            self.assertAlmostEqual(segment, geo.haversine(lats[i], lons[i], lats[i + 1], lons[i + 1]), delta=1e-6)
+        self.assertAlmostEqual(geo.track_distance(lats, lons), float(segments.sum()))
+        self.assertEqual(geo.cumulative_distance(lats, lons)[0], 0)
+
+    def test_short_tracks(self):
+        self.assertEqual(geo.track_distance([], []), 0)
+        self.assertEqual(geo.track_distance([41.3], [69.2]), 0)
+
+    def test_speeds_skip_zero_elapsed(self):
+        speeds = geo.speeds([0, 0, 0], [0, 0.001, 0.002], [0, 10, 10])
+        self.assertAlmostEqual(speeds[0], geo.haversine(0, 0, 0, 0.001) / 10)
+        self.assertEqual(speeds[1], 0)
+
+    def test_simplify_keeps_corners_and_ends(self):
+        # An L shape with points every ~11 m on both legs
+        lats = [41.0 + i * 1e-4 for i in range(10)] + [41.0009] * 9
+        lons = [69.0] * 10 + [69.0 + i * 1e-4 for i in range(1, 10)]
+        keep = geo.simplify(lats, lons, tolerance=1)
+        self.assertEqual(keep.tolist(), [0, 9, 18])
+        self.assertEqual(geo.simplify(lats[:2], lons[:2], 1).tolist(), [0, 1])
+
+
+class PackedTrackTests(APITestCase):
+    def assertTrackAlmostEqual(self, track, expected):
+        # Coordinates are stored in 1e-7 degrees, timestamps exactly
+        self.assertEqual(list(track[2]), list(expected[2]))
+        for decoded, original in zip([*track[0], *track[1]], [*expected[0], *expected[1]]):
+            self.assertAlmostEqual(decoded, original, delta=1e-7)
+
+    def test_round_trip(self):
+        start = timezone.now().replace(microsecond=123456)
+        points = make_points(200, start=start, step=1.234567e-5)
+        lats, lons, timestamps = [p['lat'] for p in points], [p['lon'] for p in points], [p['ts'] for p in points]
+        self.assertTrackAlmostEqual(unpack_track(pack_track(lats, lons, timestamps)), (lats, lons, timestamps))
+
+    def test_round_trip_empty_and_negative(self):
+        self.assertEqual(unpack_track(pack_track([], [], [])), ([], [], []))
+        ts = [timezone.now()]
+        self.assertEqual(unpack_track(pack_track([-33.8688], [-151.2093], ts)), ([-33.8688], [-151.2093], ts))
+
+    def test_unknown_version(self):
+        data = bytearray(pack_track([1.0], [2.0], [timezone.now()]))
+        data[0] = 99
+        with self.assertRaises(ValueError):
+            unpack_track(data)
+
+    def test_compacted_run_keeps_its_track(self):
+        run = self.make_run(points=50)
+        before = run.track_points()
+        self.assertEqual(run.compact_track(), 50)
+        run.refresh_from_db()
+        self.assertTrue(run.track_packed)
+        self.assertFalse(run.locations.exists())
+        self.assertTrackAlmostEqual(run.track_points(), before)
+        self.assertTrackAlmostEqual(tuple(zip(*run.iter_track())), before)
+
+        response = self.client.get('/locations/', {'run': run.id, 'page_size': 500})
+        self.assertEqual(len(response.data['results']), 50)
+
+    def test_unfiltered_list_includes_compacted_runs(self):
+        start = timezone.now().replace(microsecond=0)
+        runs = [self.make_run(date=date(2025, 1, 1) + timedelta(days=day)) for day in range(3)]
+        for run in runs:
+            run.add_points(make_points(4, start=start))
+        runs[1].compact_track()
+
+        points, response = [], self.client.get('/locations/', {'page_size': 3})
+        while True:
+            points += [(row['run'], row['timestamp']) for row in response.data['results']]
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(len(points), 12)
+        self.assertEqual(points, sorted(set(points)))
+
+    def test_compacting_a_run_without_totals(self):
+        # Tracks stored before running totals existed can still be finished once packed
+        run = self.make_run(points=10)
+        Run.objects.filter(id=run.id).update(point_count=0, started_at=None, ended_at=None)
+        run.refresh_from_db()
+        run.compact_track()
+        run.refresh_from_db()
+        self.assertEqual((run.point_count, run.ended_at), (10, run.track_points()[2][-1]))
+        self.assertEqual(self.client.post(f'/runs/{run.id}/finish/').status_code, 200)
+
+    def test_only_finished_runs_are_compacted(self):
+        old = timezone.localdate() - timedelta(days=60)
+        unfinished = self.make_run(date=old, points=10)
+        finished = self.make_run(date=old - timedelta(days=1), points=10)
+        self.client.post(f'/runs/{finished.id}/finish/')
+        call_command('compact_tracks', stdout=io.StringIO())
+        unfinished.refresh_from_db()
+        finished.refresh_from_db()
+        self.assertEqual((unfinished.track_packed, finished.track_packed), (False, True))
+
+    def test_points_added_to_a_compacted_run(self):
+        run = self.make_run(points=10)
+        run.compact_track()
+        run.refresh_from_db()
+        run.add_points(make_points(5, start=run.ended_at + timedelta(seconds=1)))
+        run.refresh_from_db()
+        self.assertFalse(run.track_packed)
+        self.assertEqual((run.locations.count(), run.point_count), (15, 15))
+
+
+class TerritoryQueryTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        # 0.005 degrees of latitude apart, about 556 m, across a cell boundary at 41.3
+        self.territories = [
+            Territory.objects.create(owner=self.user, center_lat=41.29 + i * 0.005, center_lon=69.2, radius=50)
+            for i in range(6)
+        ]
+        self.antimeridian = Territory.objects.create(owner=self.user, center_lat=0, center_lon=179.999, radius=50)
+
+    def ids(self, **params):
+        response = self.client.get('/territories/', {'page_size': 500, **params})
+        self.assertEqual(response.status_code, 200)
+        return [t['id'] for t in response.data['results']]
+
+    def test_cells(self):
+        self.assertEqual(spatial.cell_for(41.2999, 69.2) + spatial.COLS, spatial.cell_for(41.3001, 69.2))
+        self.assertEqual(spatial.cell_for(0, 180), spatial.cell_for(0, -180))
+        self.assertEqual(spatial.cell_array([41.3], [69.2]).tolist(), [spatial.cell_for(41.3, 69.2)])
+
+    def test_near_is_ordered_by_distance(self):
+        ids = self.ids(near='41.3,69.2', radius=1200)
+        expected = sorted(
+            (t for t in self.territories if geo.haversine(41.3, 69.2, t.center_lat, t.center_lon) <= 1200),
+            key=lambda t: (geo.haversine(41.3, 69.2, t.center_lat, t.center_lon), t.id),
+        )
+        self.assertEqual(ids, [t.id for t in expected])
+        self.assertEqual(len(ids), 5)
+
+    def test_bbox(self):
+        self.assertEqual(self.ids(bbox='41.294,69.1,41.306,69.3'), [t.id for t in self.territories[1:4]])
+        # Across the antimeridian
+        self.assertEqual(self.ids(bbox='-1,179,1,-179'), [self.antimeridian.id])
+
+    def test_invalid_parameters(self):
+        for params in ({'near': '41.3'}, {'near': '91,0'}, {'bbox': '1,2,3'},
+                       {'near': '41.3,69.2', 'radius': 'far'}, {'near': '41.3,69.2', 'radius': 10 ** 6}):
+            self.assertEqual(self.client.get('/territories/', params).status_code, 400, params)
+
+
+class KeysetPaginationTests(APITestCase):
+    def walk(self, url, **params):
+        ids, response = [], self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            ids += [row['id'] for row in response.data['results']]
+            if not response.data['next']:
+                return ids
+            response = self.client.get(response.data['next'])
+
+    def test_runs_pages_in_order(self):
+        runs = [self.make_run(date=date(2025, 1, 1) + timedelta(days=i)) for i in range(7)]
+        ids = self.walk('/runs/', page_size=3)
+        self.assertEqual(ids, [run.id for run in reversed(runs)])
+
+    def test_ties_are_broken_by_id(self):
+        # Locations of several runs share timestamps, ordered by (run_id, timestamp, id)
+        start = timezone.now().replace(microsecond=0)
+        for day in range(3):
+            self.make_run(date=date(2025, 1, 1) + timedelta(days=day)).add_points(make_points(4, start=start))
+        ids = self.walk('/locations/', page_size=5)
+        self.assertEqual(len(ids), 12)
+        self.assertEqual(len(set(ids)), 12)
+
+    def test_page_does_not_shift_when_rows_are_added(self):
+        for i in range(4):
+            self.make_run(date=date(2025, 1, 1) + timedelta(days=i))
+        first = self.client.get('/runs/', {'page_size': 2})
+        self.make_run(date=date(2026, 1, 1))
+        second = self.client.get(first.data['next'])
+        self.assertEqual(len(second.data['results']), 2)
+        self.assertFalse({r['id'] for r in first.data['results']} & {r['id'] for r in second.data['results']})
+
+    def test_invalid_cursor(self):
+        for cursor in ('garbage', 'WzFd', 'WyJ4IiwieSJd'):
+            self.assertEqual(self.client.get('/runs/', {'cursor': cursor}).status_code, 404, cursor)
+
+
+class CaptureTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = User.objects.create_user('other', password='secret', weight=60, height=170)
+
+    def test_first_run_claims_territory(self):
+        run = self.make_run(points=100)
+        result = capture_territories(run)
+        self.assertEqual(len(result['claimed']), 1)
+        territory = Territory.objects.get()
+        self.assertEqual((territory.owner, territory.radius), (self.user, 200))
+        self.assertEqual(result['territory'], territory.id)
+        run.refresh_from_db()
+        self.assertEqual(run.territory, territory)
+
+    def test_long_route_claims_spaced_territories(self):
+        # About 2.2 km, claims are at least two radii apart
+        run = self.make_run()
+        run.add_points(make_points(1000))
+        capture_territories(run)
+        centers = list(Territory.objects.order_by('center_lat').values_list('center_lat', 'center_lon'))
+        self.assertGreater(len(centers), 2)
+        for (lat1, lon1), (lat2, lon2) in zip(centers, centers[1:]):
+            self.assertGreaterEqual(geo.haversine(lat1, lon1, lat2, lon2), 400)
+
+    def test_running_through_captures_and_holds(self):
+        capture_territories(self.make_run(user=self.other, points=100))
+        territory = Territory.objects.get()
+
+        result = capture_territories(self.make_run(points=100))
+        self.assertEqual((result['captured'], result['claimed']), ([territory.id], []))
+        territory.refresh_from_db()
+        self.assertEqual(territory.owner, self.user)
+
+        again = capture_territories(self.make_run(date=date(2025, 1, 1), points=100))
+        self.assertEqual((again['captured'], again['held']), ([], [territory.id]))
+
+    def test_brief_pass_does_not_capture(self):
+        capture_territories(self.make_run(user=self.other, points=100))
+        territory = Territory.objects.get()
+        # 60 m between fixes: fewer than TERRITORY_CAPTURE_MIN_POINTS inside the 200 m radius
+        run = self.make_run()
+        run.add_points(make_points(20, lat=41.296, step=5.4e-4))
+        result = capture_territories(run)
+        self.assertEqual(result['captured'], [])
+        territory.refresh_from_db()
+        self.assertEqual(territory.owner, self.other)
+
+
+class StatsTests(APITestCase):
+    def finished(self, day, distance, duration=600, calories=50, user=None):
+        run = self.make_run(user=user, date=day)
+        run.distance, run.duration, run.calories = distance, duration, calories
+        run.finished_at = timezone.now()
+        run.save(update_fields=['distance', 'duration', 'calories', 'finished_at'])
+        record_run(run)
+        return run
+
+    def stat(self, period, start, user=None):
+        return UserStat.objects.get(user=user or self.user, period=period, period_start=start)
+
+    def test_runs_add_to_every_period(self):
+        # Monday and Wednesday of the same week, and the Monday after
+        self.finished(date(2026, 3, 2), 1000)
+        self.finished(date(2026, 3, 4), 2000)
+        self.finished(date(2026, 3, 9), 500)
+        self.assertEqual(self.stat('day', date(2026, 3, 4)).distance, 2000)
+        week = self.stat('week', date(2026, 3, 2))
+        self.assertEqual((week.distance, week.duration, week.calories, week.run_count), (3000, 1200, 100, 2))
+        self.assertEqual(self.stat('month', date(2026, 3, 1)).run_count, 3)
+
+    def test_finishing_again_adds_the_difference(self):
+        run = self.finished(date(2026, 3, 4), 1000)
+        run.distance = 1500
+        run.save(update_fields=['distance'])
+        record_run(run)
+        record_run(run)
+        week = self.stat('week', date(2026, 3, 2))
+        self.assertEqual((week.distance, week.run_count), (1500, 1))
+
+    def test_rebuild_matches_incremental(self):
+        self.finished(date(2026, 3, 2), 1000)
+        self.finished(date(2026, 3, 9), 500)
+        self.make_run(date=date(2026, 3, 10), points=10)  # not finished
+        incremental = set(UserStat.objects.values_list('period', 'period_start', 'distance', 'run_count'))
+        UserStat.objects.all().delete()
+        rebuild_stats()
+        self.assertEqual(set(UserStat.objects.values_list('period', 'period_start', 'distance', 'run_count')),
+                         incremental)
+
+    def test_stats_and_leaderboard(self):
+        other = User.objects.create_user('other', password='secret', weight=60, height=170)
+        self.finished(date(2026, 3, 4), 1000)
+        self.finished(date(2026, 3, 4), 3000, user=other)
+
+        stats = self.client.get('/stats/', {'period': 'month'}).data['results']
+        self.assertEqual([(row['period_start'], row['distance']) for row in stats], [('2026-03-01', 1000)])
+
+        board = self.client.get('/leaderboard/', {'period': 'week', 'date': '2026-03-06'}).data
+        self.assertEqual(board['period_start'], date(2026, 3, 2))
+        self.assertEqual([(row['rank'], row['username']) for row in board['results']], [(1, 'other'), (2, 'runner')])
+        self.assertEqual(self.client.get('/leaderboard/', {'metric': 'speed'}).status_code, 400)
+
+
+class StreamingIngestTests(APITestCase):
+    def stream(self, run_id, chunks, user=None):
+        messages = [{'type': 'http.request', 'body': chunk, 'more_body': i < len(chunks) - 1}
+                    for i, chunk in enumerate(chunks)]
+        sent = []
+
+        async def receive():
+            return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        async def django_app(scope, receive, send):
+            raise AssertionError("Stream requests don't reach Django")
+
+        token = AccessToken.for_user(user or self.user)
+        scope = {'type': 'http', 'method': 'POST', 'path': f'/runs/{run_id}/stream/',
+                 'headers': [(b'authorization', f'Bearer {token}'.encode())]}
+        async_to_sync(StreamingIngestApp(django_app))(scope, receive, send)
+        return sent[0]['status'], json.loads(sent[1]['body'])
+
+    def test_lines_split_across_chunks(self):
+        run = self.make_run()
+        body = ''.join(json.dumps(point) + '\n' for point in as_json(make_points(20))).encode()
+        status, result = self.stream(run.id, [body[i:i + 37] for i in range(0, len(body), 37)])
+        self.assertEqual(status, 200)
+        self.assertEqual((result['received'], result['created'], result['rejected']), (20, 20, 0))
+        self.assertEqual(run.locations.count(), 20)
+
+    def test_bad_lines_are_reported_and_the_rest_stored(self):
+        run = self.make_run()
+        points = as_json(make_points(4))
+        points[1]['lat'] = 'nan'
+        lines = [json.dumps(p) for p in points] + ['{not json']
+        status, result = self.stream(run.id, ['\n'.join(lines).encode()])
+        self.assertEqual(status, 200)
+        self.assertEqual((result['created'], result['rejected']), (3, 2))
+        self.assertEqual([error['line'] for error in result['errors']], [2, 5])
+
+    def test_other_users_run(self):
+        other = User.objects.create_user('other', password='secret', weight=60, height=170)
+        status, _ = self.stream(self.make_run(user=other).id, [b''])
+        self.assertEqual(status, 403)
+
+
+class BenchmarkTests(APITestCase):
+    def test_random_walk_runs_at_pace(self):
+        track = random_walk(random.Random(0), 100)
+        self.assertEqual(len(track), 100)
+        distance = geo.track_distance(*zip(*track))
+        self.assertAlmostEqual(distance, 99 * 3.0, delta=10)
+
+    def test_small_run(self):
+        bench = Benchmark(users=2, runs=1, points=50, territories=20, iterations=4)
+        bench.setup()
+        results = bench.run()
+        self.assertIn('POST /runs/{id}/finish/ (job inline)', results)
+        # Every finish ran its job, none was a dedupe hit
+        self.assertEqual(Job.objects.filter(kind='finish_run', status=Job.DONE).count(), 4)
+        for name, row in results.items():
+            self.assertEqual(row['requests'], 4, name)
+            self.assertLessEqual(row['p50_ms'], row['p99_ms'])
+
+
+class CachedReadTests(APITestCase):
+    def test_territory_list_etag_and_invalidation(self):
+        Territory.objects.create(owner=self.user, center_lat=41.3, center_lon=69.2, radius=50)
+        first = self.client.get('/territories/')
+        etag = first['ETag']
+        self.assertEqual(len(first.data['results']), 1)
+        self.assertEqual(self.client.get('/territories/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Territory.objects.create(owner=self.user, center_lat=41.4, center_lon=69.2, radius=50)
+        second = self.client.get('/territories/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second['ETag'], etag)
+        self.assertEqual(len(second.data['results']), 2)
+
+    def test_cached_list_is_served_without_queries(self):
+        self.client.get('/territories/')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/territories/').status_code, 200)
+
+    def test_profile_invalidated_on_save(self):
+        self.assertEqual(self.client.get('/profile/').data['weight'], 70)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.weight = 72
+            self.user.save()
+        self.assertEqual(self.client.get('/profile/').data['weight'], 72)
+
+    def test_username_change_invalidates_territories(self):
+        Territory.objects.create(owner=self.user, center_lat=41.3, center_lon=69.2, radius=50)
+        self.client.get('/territories/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.username = 'renamed'
+            self.user.save()
+        self.assertEqual(self.client.get('/territories/').data['results'][0]['owner'], 'renamed')
+
+    def test_login_and_profile_edits_keep_territories(self):
+        etag = self.client.get('/territories/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            update_last_login(None, User.objects.get(id=self.user.id))
+            user = User.objects.get(id=self.user.id)
+            user.weight = 75
+            user.save()
+        self.assertEqual(self.client.get('/territories/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+def gpx(points):
+    trkpts = ''.join(
+        f'<trkpt lat="{p["lat"]}" lon="{p["lon"]}"><ele>400</ele><time>{p["ts"].isoformat()}</time></trkpt>'
+        for p in points
+    )
+    return (f'<?xml version="1.0"?><gpx version="1.1" xmlns="http://www.topografix.com/GPX/1/1">'
+            f'<trk><trkseg>{trkpts}</trkseg></trk></gpx>').encode()
+
+
+def tcx(points):
+    trackpoints = ''.join(
+        f'<Trackpoint><Time>{p["ts"].isoformat()}</Time><Position><LatitudeDegrees>{p["lat"]}</LatitudeDegrees>'
+        f'<LongitudeDegrees>{p["lon"]}</LongitudeDegrees></Position></Trackpoint>'
+        for p in points
+    )
+    return (f'<?xml version="1.0"?><TrainingCenterDatabase xmlns="http://www.garmin.com/xmlschemas/'
+            f'TrainingCenterDatabase/v2"><Activities><Activity Sport="Running"><Lap><Track>{trackpoints}'
+            f'</Track></Lap></Activity></Activities></TrainingCenterDatabase>').encode()
+
+
+class ImportTests(APITestCase):
+    def upload(self, name, data):
+        return self.client.post('/runs/import/', {'file': SimpleUploadedFile(name, data)}, format='multipart')
+
+    def test_gpx_and_tcx_points(self):
+        points = make_points(5)
+        for data in (gpx(points), tcx(points)):
+            parsed = list(iter_track_points(io.BytesIO(data)))
+            self.assertEqual([ts for _, _, ts in parsed], [p['ts'] for p in points])
+            self.assertEqual(parsed[0][:2], (points[0]['lat'], points[0]['lon']))
+
+    def test_bad_points_are_skipped(self):
+        data = gpx(make_points(2)).replace(b'lat="41.3"', b'lat="north"')
+        self.assertEqual(len(list(iter_track_points(io.BytesIO(data)))), 1)
+
+    def test_import_creates_measured_runs(self):
+        start = timezone.now().replace(hour=10, minute=0, second=0, microsecond=0) - timedelta(days=3)
+        response = self.upload('run.gpx', gpx(make_points(100, start=start)))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['runs'], response.data['points'], response.data['created']), (1, 100, 100))
+        run = Run.objects.get(user=self.user)
+        self.assertIsNotNone(run.finished_at)
+        self.assertEqual(run.duration, 99)
+        self.assertIsNotNone(run.summary)
+        self.assertEqual(UserStat.objects.get(period='day', period_start=run.date).run_count, 1)
+
+    def test_zip_of_gzipped_files_and_reimport(self):
+        day1 = timezone.now().replace(hour=10, minute=0, second=0, microsecond=0) - timedelta(days=5)
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as zf:
+            zf.writestr('a.gpx.gz', gzip.compress(gpx(make_points(10, start=day1))))
+            zf.writestr('b.tcx', tcx(make_points(10, start=day1 + timedelta(days=1))))
+            zf.writestr('notes.txt', 'ignored')
+        response = self.upload('export.zip', archive.getvalue())
+        self.assertEqual((response.data['files'], response.data['runs'], response.data['created']), (2, 2, 20))
+
+        again = self.upload('export.zip', archive.getvalue())
+        self.assertEqual((again.data['points'], again.data['created']), (20, 0))
+
+    def test_broken_files(self):
+        response = self.upload('run.gpx', b'<gpx><trk>')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data['failed_files']), 1)
+        self.assertEqual(self.upload('run.zip', b'not a zip').status_code, 400)
+
+
+class SimplifyTracksTests(APITestCase):
+    def old_finished_run(self, points=200):
+        run = self.make_run(date=timezone.localdate() - timedelta(days=60), points=points)
+        self.client.post(f'/runs/{run.id}/finish/')
+        run.refresh_from_db()
+        return run
+
+    def simplify(self, *args):
+        call_command('simplify_tracks', *args, stdout=io.StringIO())
+
+    def test_straight_track_keeps_ends_and_totals(self):
+        run = self.old_finished_run()
+        totals = (run.distance, run.duration, run.calories)
+        first, last = run.track_points()[2][0], run.track_points()[2][-1]
+
+        self.simplify()
+        run.refresh_from_db()
+        self.assertTrue(run.track_simplified)
+        self.assertEqual(run.locations.count(), 2)
+        self.assertEqual(run.point_count, 2)
+        self.assertEqual(run.track_points()[2], [first, last])
+        self.assertEqual((run.distance, run.duration, run.calories), totals)
+
+    def test_finishing_again_keeps_the_full_track_totals(self):
+        run = self.old_finished_run()
+        totals = (run.distance, run.duration, run.calories, run.summary)
+        stat = UserStat.objects.get(period='day', period_start=run.date)
+        self.simplify()
+        response = self.client.post(f'/runs/{run.id}/finish/')
+        self.assertEqual(response.status_code, 200)
+        run.refresh_from_db()
+        self.assertEqual((run.distance, run.duration, run.calories, run.summary), totals)
+        self.assertEqual(UserStat.objects.get(id=stat.id).distance, stat.distance)
+
+    def test_packed_track(self):
+        run = self.old_finished_run()
+        run.compact_track()
+        self.simplify()
+        run.refresh_from_db()
+        self.assertEqual(len(run.track_points()[2]), 2)
+        self.assertEqual(run.track.point_count, 2)
+
+    def test_dry_run_recent_and_unfinished_runs(self):
+        old = self.old_finished_run()
+        self.make_run(date=timezone.localdate() - timedelta(days=90), points=50)
+        self.simplify('--dry-run')
+        self.assertEqual(old.locations.count(), 200)
+        self.simplify('--days', '90')
+        self.assertEqual(old.locations.count(), 200)
+        self.simplify()
+        self.assertEqual(Run.objects.filter(track_simplified=True).count(), 1)
+
+
+class BuildSchemaTests(TestCase):
+    def test_writes_schema_and_gzip_copy(self):
+        with TemporaryDirectory() as tmp:
+            path = f'{tmp}/openapi.json'
+            call_command('build_schema', output=path, stdout=io.StringIO())
+            with open(path, 'rb') as f:
+                data = f.read()
+            with gzip.open(f'{path}.gz') as f:
+                self.assertEqual(f.read(), data)
+        schema = json.loads(data)
+        self.assertIn('/runs/{id}/finish/', schema['paths'])
+        self.assertIn('/sync/', schema['paths'])
+
+
+class UserCacheTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        user_cache.clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def test_lru_and_ttl(self):
+        lru = UserCache(size=2, ttl=60)
+        lru.set(1, 'a')
+        lru.set(2, 'b')
+        lru.get(1)
+        lru.set(3, 'c')
+        self.assertEqual((lru.get(1), lru.get(2), lru.get(3)), ('a', None, 'c'))
+        with mock.patch('app.authentication.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertIsNone(lru.get(1))
+
+    def test_second_request_skips_the_user_query(self):
+        self.client.get('/stats/')
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/stats/').status_code, 200)
+
+    def test_deactivated_user_is_refused(self):
+        self.assertEqual(self.client.get('/stats/').status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.client.get('/stats/').status_code, 401)
+
+
+class PipelineTests(TestCase):
+    def track(self, count, step=2e-5):
+        # (lat, lon, seconds), about 2.2 m per second northwards for the default step
+        return [(41.3 + i * step, 69.2, float(i)) for i in range(count)]
+
+    def test_dedupe(self):
+        points = [(0, 0, 1.0), (0, 0, 1.0), (0, 0, 3.0), (0, 0, 2.0), (0, 0, 4.0)]
+        self.assertEqual([p[2] for p in pipeline.dedupe(points)], [1.0, 3.0, 4.0])
+
+    def test_speed_outliers(self):
+        points = self.track(10)
+        points[5] = (42.0, 69.2, 5.0)  # a 77 km jump
+        kept = list(pipeline.drop_speed_outliers(points, max_speed=12.0))
+        self.assertEqual([p[2] for p in kept], [0, 1, 2, 3, 4, 6, 7, 8, 9])
+
+    def test_real_moves_are_kept_after_max_skipped(self):
+        # The track really continues 1 km away (signal lost), the outlier filter gives in
+        points = self.track(3) + [(41.31 + i * 2e-5, 69.2, 3.0 + i) for i in range(10)]
+        kept = list(pipeline.drop_speed_outliers(points, max_speed=12.0, max_skipped=5))
+        self.assertEqual(len(kept), 3 + 10 - 5)
+
+    def test_jitter_keeps_the_last_fix(self):
+        points = [(41.3, 69.2, float(i)) for i in range(10)]
+        kept = list(pipeline.drop_jitter(points, min_distance=2.0))
+        self.assertEqual([p[2] for p in kept], [0.0, 9.0])
+
+    def test_measure_straight_track(self):
+        distance, duration, summary = measure(self.track(1001, step=1e-4), config=[])
+        self.assertAlmostEqual(distance, 1000 * geo.haversine(0, 0, 1e-4, 0), delta=1)
+        self.assertEqual(duration, 1000)
+        self.assertEqual(len(summary['splits']), 12)
+        self.assertEqual(summary['splits'][0][0], 1000)
+        self.assertAlmostEqual(summary['best_pace'], 1000 / 11.12, delta=1)
+        self.assertAlmostEqual(summary['max_speed'], 11.12, delta=0.01)
+        self.assertEqual(summary['moving_time'], 1000)
+
+    def test_measure_matches_across_chunks(self):
+        track = self.track(5000)
+        with mock.patch('app.pipeline.MEASURE_CHUNK', 7):
+            chunked = measure(track, config=[])
+        self.assertAlmostEqual(chunked[0], measure(track, config=[])[0], places=6)
+        self.assertEqual(chunked[2]['splits'], measure(track, config=[])[2]['splits'])
+
+    def test_standing_still_is_not_moving_time(self):
+        track = self.track(100) + [(41.3 + 99 * 2e-5, 69.2, 100.0 + i) for i in range(100)]
+        _, duration, summary = measure(track, config=[])
+        self.assertEqual(duration, 199)
+        self.assertEqual(summary['moving_time'], 99)
+
+    def test_empty_track(self):
+        self.assertEqual(measure([], config=[]), (0.0, 0, None))
+
+    def test_default_pipeline_shortens_a_noisy_track(self):
+        rng = random.Random(0)
+        clean = self.track(600)
+        noisy = [(lat + rng.gauss(0, 3e-5), lon + rng.gauss(0, 3e-5), t) for lat, lon, t in clean]
+        true = geo.track_distance([p[0] for p in clean], [p[1] for p in clean])
+        raw = geo.track_distance([p[0] for p in noisy], [p[1] for p in noisy])
+        self.assertLess(abs(measure(noisy)[0] - true), abs(raw - true))
+
+
+class RunSummaryTests(APITestCase):
+    def test_summary_is_stored_at_finish(self):
+        run = self.make_run(points=600)
+        self.client.post(f'/runs/{run.id}/finish/')
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/runs/{run.id}/summary/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['run'], run.id)
+        self.assertEqual([meters for meters, _ in response.data['splits']][:1], [1000])
+        self.assertIn('best_pace', response.data)
+
+    def test_unfinished_run(self):
+        run = self.make_run(points=10)
+        self.assertEqual(self.client.get(f'/runs/{run.id}/summary/').status_code, 404)
+
+    def test_missing_summary_is_backfilled(self):
+        run = self.make_run(points=100)
+        self.client.post(f'/runs/{run.id}/finish/')
+        Run.objects.filter(id=run.id).update(summary=None)
+        self.assertIn('splits', self.client.get(f'/runs/{run.id}/summary/').data)
+        run.refresh_from_db()
+        self.assertIsNotNone(run.summary)
+
+    def test_summary_is_opt_in_on_runs(self):
+        run = self.make_run(points=100)
+        self.client.post(f'/runs/{run.id}/finish/')
+        self.assertNotIn('summary', self.client.get(f'/runs/{run.id}/').data)
+        self.assertNotIn('summary', self.client.get('/runs/').data['results'][0])
+        self.assertIn('splits', self.client.get(f'/runs/{run.id}/', {'include': 'summary'}).data['summary'])
+        self.assertIn('summary', self.client.get('/runs/', {'include': 'summary'}).data['results'][0])
+
+
+flaky_calls = []
+
+
+def flaky_task(fail_times):
+    # A job task failing its first `fail_times` calls
+    flaky_calls.append(fail_times)
+    if len(flaky_calls) <= fail_times:
+        raise RuntimeError('try again')
+    return {'calls': len(flaky_calls)}
+
+
+@override_settings(JOB_RUN_INLINE=False, JOB_RETRY_DELAY=0)
+class JobTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        flaky_calls.clear()
+        patcher = mock.patch.dict(jobs.TASKS, {'flaky': 'app.tests.flaky_task'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_queued(self):
+        runner = jobs.JobRunner()
+        while (job_id := runner.claim_next()) is not None:
+            runner.execute(job_id)
+
+    def enqueue(self, key='k', fail_times=0):
+        return jobs.enqueue('flaky', key, user=self.user, fail_times=fail_times)
+
+    def test_same_key_is_deduplicated(self):
+        first = self.enqueue()
+        self.assertEqual(self.enqueue().id, first.id)
+        self.run_queued()
+        self.assertEqual(self.enqueue().id, first.id)
+        self.assertEqual(Job.objects.count(), 1)
+        self.assertEqual(Job.objects.get().status, Job.DONE)
+
+    def test_retries_then_succeeds(self):
+        job = self.enqueue(fail_times=2)
+        with self.assertLogs('app.jobs', 'ERROR'):
+            self.run_queued()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.result), (Job.DONE, 3, {'calls': 3}))
+
+    def test_gives_up_and_can_be_queued_again(self):
+        job = self.enqueue(fail_times=10)
+        with self.assertLogs('app.jobs', 'ERROR'):
+            self.run_queued()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 3))
+        self.assertEqual(len(flaky_calls), 3)
+        self.assertIn('try again', job.error)
+        self.assertNotEqual(self.enqueue(fail_times=0).id, job.id)
+
+    def test_retry_waits(self):
+        with override_settings(JOB_RETRY_DELAY=60), self.assertLogs('app.jobs', 'ERROR'):
+            job = self.enqueue(fail_times=1)
+            self.run_queued()
+            self.run_queued()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=50))
+
+    def test_claim_is_exclusive(self):
+        job = self.enqueue()
+        self.assertEqual(jobs.claim(job.id), 1)
+        self.assertEqual(jobs.claim(job.id), 0)
+
+    def test_lost_jobs_are_requeued(self):
+        job = self.enqueue()
+        jobs.claim(job.id, now=timezone.now() - timedelta(hours=1))
+        jobs.JobRunner().requeue_lost()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+
+    def test_finish_returns_the_job(self):
+        run = self.make_run(points=10)
+        response = self.client.post(f'/runs/{run.id}/finish/')
+        self.assertEqual((response.status_code, response.data['status']), (202, Job.QUEUED))
+        self.assertEqual(self.client.post(f'/runs/{run.id}/finish/').data['id'], response.data['id'])
+        self.run_queued()
+        job = self.client.get(f'/jobs/{response.data["id"]}/').data
+        self.assertEqual((job['status'], job['result']['id']), (Job.DONE, run.id))
+
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user('other', password='secret', weight=60, height=170))
+        self.assertEqual(other.get(f'/jobs/{response.data["id"]}/').status_code, 404)
@@ -0,0 +1,49 @@
+import struct
+import zlib
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+# Packed track layout: header (version, point count) followed by a zlib stream of
+# three int64 rows - lat and lon in 1e-7 degrees (~1 cm) and timestamps in
+# microseconds - each delta-encoded, so a steady 1 Hz track compresses to a few
+# bytes per point.
+VERSION = 1
+HEADER = struct.Struct('<BI')
+COORD_SCALE = 10 ** 7
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def pack_track(lats, lons, timestamps):
+    count = len(timestamps)
+    rows = np.empty((3, count), dtype=np.int64)
+    rows[0] = np.round(np.asarray(lats, dtype=float) * COORD_SCALE)
+    rows[1] = np.round(np.asarray(lons, dtype=float) * COORD_SCALE)
+    rows[2] = [_to_micros(ts) for ts in timestamps]
+
+    deltas = np.diff(rows, axis=1, prepend=0)
+    return HEADER.pack(VERSION, count) + zlib.compress(deltas.tobytes())
+
+
+def unpack_track(data):
+    data = bytes(data)
+    version, count = HEADER.unpack_from(data)
+    if version != VERSION:
+        raise ValueError(f"Unsupported track version: {version}")
+
+    deltas = np.frombuffer(zlib.decompress(data[HEADER.size:]), dtype=np.int64).reshape(3, count)
+    rows = np.cumsum(deltas, axis=1)
+    lats = (rows[0] / COORD_SCALE).tolist()
+    lons = (rows[1] / COORD_SCALE).tolist()
+    timestamps = [_from_micros(int(us)) for us in rows[2]]
+    return lats, lons, timestamps
+
+
+def _to_micros(ts):
+    delta = ts - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 10 ** 6 + delta.microseconds
+
+
+def _from_micros(us):
+    return EPOCH + timedelta(microseconds=us)
+
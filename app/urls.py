@@ -5,19 +5,24 @@ from rest_framework import permissions
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
-from .views import RunViewSet, RunLocationViewSet, TerritoryViewSet, RegisterView, UserProfileView
+from .metrics import metrics_view
+from .views import RunViewSet, RunLocationViewSet, TerritoryViewSet, RegisterView, UserProfileView, UserStatsView, \
+    LeaderboardView, HeatmapView, JobViewSet, SyncView
 
 router = DefaultRouter()
 router.register('runs', RunViewSet, basename='runs')
 router.register('locations', RunLocationViewSet, basename='locations')
 router.register('territories', TerritoryViewSet, basename='territories')
+router.register('jobs', JobViewSet, basename='jobs')
+
+api_info = openapi.Info(
+    title="RunQuest API",
+    default_version='v1',
+    description="Kunlik energiyangizni va yugurishingizni nazorat qiling!",
+)
 
 schema_view = get_schema_view(
-    openapi.Info(
-        title="RunQuest API",
-        default_version='v1',
-        description="Kunlik energiyangizni va yugurishingizni nazorat qiling!",
-    ),
+    api_info,
     public=True,
     permission_classes=(permissions.AllowAny,),
 )
@@ -28,6 +33,11 @@ urlpatterns = [
     path('login/', TokenObtainPairView.as_view(), name='login'),
     path('refresh/', TokenRefreshView.as_view(), name='refresh'),
     path('profile/', UserProfileView.as_view(), name='profile'),
+    path('stats/', UserStatsView.as_view(), name='stats'),
+    path('leaderboard/', LeaderboardView.as_view(), name='leaderboard'),
+    path('sync/', SyncView.as_view(), name='sync'),
+    path('heatmap/<int:z>/<int:x>/<int:y>/', HeatmapView.as_view(), name='heatmap'),
+    path('metrics/', metrics_view, name='metrics'),
 
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0),
          name='schema-swagger-ui'),
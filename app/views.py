@@ -1,27 +1,78 @@
+import zipfile
+from datetime import date
+
+from django.conf import settings
+from django.db.models import Q
 from django.utils import timezone
-import math
 
 from rest_framework import viewsets, status, generics, permissions
 from rest_framework.permissions import IsAuthenticated
 
 from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 
-from app.models import calc_calories, RunLocation, Run, Territory, User
+from app import cache, spatial
+from app.export import ExportNegotiation, export_response
+from app.heatmap import tile
+from app.importer import TrackImporter
+from app.jobs import enqueue
+from app.live import can_follow, feed, share_token
+from app.pipeline import measure
+from app.stats import METRICS, PERIODS, period_start
+from app.sync import changes, decode_token
+from app.writer import writer
+from app.models import Job, RunLocation, Run, Territory, User, UserStat
 from app.serializers import RunSerializer, RunLocationSerializer, TerritorySerializer, UserSerializer, \
-    RegisterSerializer
+    RegisterSerializer, LocationBatchSerializer, LocationPointSerializer, UserStatSerializer, LeaderboardSerializer, \
+    JobSerializer, include_summary
+
+
+def ingest_points(run, data):
+    serializer = LocationBatchSerializer(data=data)
+    serializer.is_valid(raise_exception=True)
+    points = serializer.validated_data['points']
+
+    feed.publish(run.id, run.user_id, points)
+    created = len(run.add_points(points))
+    return Response({
+        "run": run.id,
+        "received": len(points),
+        "created": created,
+        "skipped": len(points) - created,
+    }, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+
+def parse_coords(value, count, name):
+    try:
+        values = [float(v) for v in value.split(',')]
+    except ValueError:
+        values = []
+    if len(values) != count:
+        raise ValidationError({name: f'Expected {count} comma separated numbers.'})
+
+    lats = values[0::2]
+    lons = values[1::2]
+    if not all(-90 <= lat <= 90 for lat in lats) or not all(-180 <= lon <= 180 for lon in lons):
+        raise ValidationError({name: 'Coordinates out of range.'})
+    return values
 
 
 class RunViewSet(viewsets.ModelViewSet):
     queryset = Run.objects.all()
     serializer_class = RunSerializer
     permission_classes = [IsAuthenticated]
+    cursor_ordering = ('-date', '-id')
 
     def get_queryset(self):
         user = self.request.user
         if not user.is_authenticated:
             return Run.objects.none()
-        return Run.objects.filter(user=user).order_by('-date')
+        runs = Run.objects.filter(user=user).order_by('-date')
+        if self.action == 'list' and not include_summary(self.request):
+            runs = runs.defer('summary')
+        return runs
 
     def create(self, request, *args, **kwargs):
         user = request.user
@@ -41,42 +92,103 @@ class RunViewSet(viewsets.ModelViewSet):
         if lat is None or lon is None:
             return Response({"error": "lat and lon required"}, status=400)
 
-        RunLocation.objects.create(run=run, lat=lat, lon=lon)
+        serializer = LocationPointSerializer(data={'lat': lat, 'lon': lon, 'ts': timezone.now()})
+        serializer.is_valid(raise_exception=True)
+        point = serializer.validated_data
+
+        feed.publish(run.id, run.user_id, [point])
+        if settings.LOCATION_WRITE_BEHIND:
+            writer.add(run.id, point)
+        else:
+            run.add_points([point])
 
         return Response({"message": "location added"}, status=200)
 
+    @action(detail=True, methods=['post'])
+    def add_locations(self, request, pk=None):
+        return ingest_points(self.get_object(), request.data)
+
     @action(detail=True, methods=['post'])
     def finish(self, request, pk=None):
         run = self.get_object()
+        delay = 0
+        if settings.LOCATION_WRITE_BEHIND:
+            # Points of this run can also be buffered by the writers of other workers, which
+            # write them within LOCATION_WRITER_FLUSH_SECONDS; the job waits for those
+            writer.flush(run.id)
+            delay = settings.LOCATION_WRITER_FINISH_WAIT
+
+        # Measuring, territory capture and stats run as a job, which also checks the run has
+        # enough points. The key is the run's last finish: finishing again before the job has
+        # run returns the same job, finishing after it measures again with any new points.
+        finished = run.finished_at.timestamp() if run.finished_at else 0
+        job = enqueue('finish_run', f'finish:{run.id}:{finished}', user=request.user, delay=delay, run_id=run.id)
+        feed.finish(run.id)
+        return Response(JobSerializer(job).data, status={Job.DONE: 200, Job.FAILED: 400}.get(job.status, 202))
+
+    @action(detail=True, methods=['get'])
+    def summary(self, request, pk=None):
+        run = self.get_object()
+        if run.finished_at is None:
+            return Response({"error": "Run is not finished"}, status=404)
+        if run.summary is None and run.point_count >= 2:
+            # Finished before summaries were stored
+            _, _, run.summary = measure(run.iter_track())
+            run.save(update_fields=['summary'])
+        return Response({
+            'run': run.id,
+            'distance': run.distance,
+            'duration': run.duration,
+            'calories': run.calories,
+            **(run.summary or {}),
+        })
+
+    @action(detail=True, methods=['get'])
+    def live(self, request, pk=None):
+        # Served from process memory without loading the run; under ASGI the same URL
+        # with "Accept: text/event-stream" is a server-sent event stream (app.streaming)
+        cursor = request.query_params.get('cursor', '0')
+        if not cursor.isdigit():
+            raise ValidationError({'cursor': 'Must be a number.'})
+        run_id = int(pk) if pk.isdigit() else None
+        owner = feed.owner(run_id)
+        update = None
+        if owner is not None and can_follow(run_id, owner, request.user.pk, request.query_params.get('share')):
+            update = feed.since(run_id, int(cursor))
+        if update is None:
+            return Response({"error": "Run is not live"}, status=404)
+        return Response({'run': run_id, **update})
 
-        locations = run.locations.order_by("timestamp")
-        if len(locations) < 2:
-            return Response({"error": "Not enough points to calculate distance"}, status=400)
-
-        # Haversine distance
-        def dist(lat1, lon1, lat2, lon2):
-            R = 6371000
-            phi1, phi2 = math.radians(lat1), math.radians(lat2)
-            dphi = math.radians(lat2 - lat1)
-            dlambda = math.radians(lon2 - lon1)
-            a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
-            return R * (2 * math.atan2(math.sqrt(a), math.sqrt(1 - a)))
-
-        total_dist = 0
-        for i in range(len(locations) - 1):
-            p1 = locations[i]
-            p2 = locations[i + 1]
-            total_dist += dist(p1.lat, p1.lon, p2.lat, p2.lon)
-
-        run.distance = round(total_dist, 2)
-
-        duration_seconds = (locations.last().timestamp - locations.first().timestamp).total_seconds()
-        run.duration = int(duration_seconds)
-
-        run.calories = calc_calories(run.distance, run.duration, run.user.weight)
-        run.save()
+    @action(detail=True, methods=['post'])
+    def share_live(self, request, pk=None):
+        # Token that lets other users follow this run: /runs/<id>/live/?share=<token>
+        run = self.get_object()
+        return Response({'run': run.id, 'share': share_token(run.id), 'expires_in': settings.LIVE_SHARE_SECONDS})
 
-        return Response(RunSerializer(run).data, status=200)
+    @action(detail=True, methods=['get'], url_path=r'export/(?P<fmt>gpx|geojson|csv)',
+            content_negotiation_class=ExportNegotiation)
+    def export(self, request, pk=None, fmt=None):
+        run = self.get_object()
+        return export_response([run], fmt, f'run-{run.date}')
+
+    @action(detail=False, methods=['get'], url_path=r'export/(?P<fmt>gpx|geojson|csv)',
+            content_negotiation_class=ExportNegotiation)
+    def export_all(self, request, fmt=None):
+        runs = self.get_queryset().order_by('date').iterator()
+        return export_response(runs, fmt, f'runquest-{request.user.username}')
+
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser])
+    def import_tracks(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"error": "file required"}, status=400)
+
+        importer = TrackImporter(request.user)
+        try:
+            importer.import_file(upload, upload.name)
+        except (zipfile.BadZipFile, OSError) as exc:
+            return Response({"error": f"Can't read upload: {exc}"}, status=400)
+        return Response(importer.close(), status=201)
 
     def update(self, *args, **kwargs):
         return Response({'detail': 'Editing run data is not allowed.'}, status=405)
@@ -86,15 +198,66 @@ class RunViewSet(viewsets.ModelViewSet):
 
 
 class RunLocationViewSet(viewsets.ModelViewSet):
+    """
+    GPS points of the user's runs. Compacted runs (compact_tracks) keep their points in a
+    packed blob, which the list decodes; those points have no id, so /locations/<id>/
+    only finds points of runs that aren't compacted.
+    """
     queryset = RunLocation.objects.all()
     serializer_class = RunLocationSerializer
     permission_classes = [IsAuthenticated]
+    cursor_ordering = ('run_id', 'timestamp', 'id')
 
     def get_queryset(self):
         user = self.request.user
         if not user.is_authenticated:
             return RunLocation.objects.none()
-        return RunLocation.objects.filter(run__user=user)
+        queryset = RunLocation.objects.filter(run__user=user)
+
+        run_id = self.request.query_params.get('run')
+        if run_id is not None:
+            if not run_id.isdigit():
+                return RunLocation.objects.none()
+            queryset = queryset.filter(run_id=run_id).order_by('timestamp')
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        run_id = request.query_params.get('run')
+        run = Run.objects.filter(id=run_id, user=request.user).first() if str(run_id).isdigit() else None
+        if run is not None and run.track_packed:
+            # Compacted runs have no rows left, decode their track on demand
+            self.cursor_ordering = ('timestamp',)
+            page = self.paginate_queryset(run.packed_locations())
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        if run_id is None:
+            page = self.paginate_queryset(self.locations_after)
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
+        return super().list(request, *args, **kwargs)
+
+    def locations_after(self, position):
+        # The user's points after the cursor position in (run_id, timestamp, id) order, run
+        # by run from the rows or the packed track. Packed points have no id, but a run has
+        # one point per timestamp.
+        runs = Run.objects.filter(user=self.request.user).only('id', 'track_packed').order_by('id')
+        if position is not None:
+            run_id, moment, pk = position
+            runs = runs.filter(id__gte=run_id)
+        for run in runs.iterator():
+            resume = position is not None and run.id == run_id
+            if run.track_packed:
+                points = run.packed_locations()
+                yield from (point for point in points if point.timestamp > moment) if resume else points
+                continue
+            rows = run.locations.order_by('timestamp', 'id')
+            if resume:
+                after = Q(timestamp__gt=moment)
+                if pk is not None:
+                    after |= Q(timestamp=moment, id__gt=pk)
+                rows = rows.filter(after)
+            yield from rows.iterator()
 
     def create(self, request, *args, **kwargs):
         run_id = request.data.get('run')
@@ -107,6 +270,24 @@ class RunLocationViewSet(viewsets.ModelViewSet):
 
         return super().create(request, *args, **kwargs)
 
+    def perform_create(self, serializer):
+        data = serializer.validated_data
+        run = data['run']
+        ts = data.get('timestamp') or timezone.now()
+
+        created = run.add_points([{'lat': data['lat'], 'lon': data['lon'], 'ts': ts}])
+        serializer.instance = created[0] if created else run.locations.filter(timestamp=ts).first()
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        run_id = request.data.get('run') if isinstance(request.data, dict) else None
+        run = Run.objects.filter(id=run_id, user=request.user).first() if str(run_id).isdigit() else None
+        if run is None:
+            return Response({"detail": "You can't attach location to another user's run."},
+                            status=status.HTTP_403_FORBIDDEN)
+
+        return ingest_points(run, request.data)
+
     def update(self, *args, **kwargs):
         return Response({'detail': 'Editing locations is not allowed.'}, status=405)
 
@@ -118,11 +299,37 @@ class TerritoryViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Territory.objects.all()
     serializer_class = TerritorySerializer
     permission_classes = [IsAuthenticated]
+    cursor_ordering = ('id',)
 
     def get_queryset(self):
         if not self.request.user.is_authenticated:
             return Territory.objects.none()
-        return Territory.objects.all()
+        queryset = Territory.objects.select_related('owner')
+
+        params = self.request.query_params
+        if 'near' in params:
+            lat, lon = parse_coords(params['near'], 2, 'near')
+            try:
+                radius = float(params.get('radius', settings.TERRITORY_NEAR_RADIUS))
+            except ValueError:
+                raise ValidationError({'radius': 'Must be a number of meters.'})
+            if not 0 < radius <= settings.TERRITORY_NEAR_RADIUS_MAX:
+                raise ValidationError({'radius': f'Must be between 0 and {settings.TERRITORY_NEAR_RADIUS_MAX} meters.'})
+
+            # Narrow by grid cell through the index, then check the exact distance
+            queryset = queryset.filter(spatial.cell_filter(*spatial.bbox_around(lat, lon, radius)))
+            queryset = queryset.annotate(distance=spatial.distance_expression(lat, lon))
+            queryset = queryset.filter(distance__lte=radius)
+            self.cursor_ordering = ('distance', 'id')
+
+        elif 'bbox' in params:
+            queryset = queryset.filter(spatial.bbox_filter(*parse_coords(params['bbox'], 4, 'bbox')))
+
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        return cache.cached_response(request, cache.TERRITORIES, lambda: super(TerritoryViewSet, self).list(
+            request, *args, **kwargs))
 
 
 class RegisterView(generics.CreateAPIView):
@@ -149,3 +356,112 @@ class UserProfileView(generics.RetrieveUpdateAPIView):
         if user.is_anonymous:
             return None
         return user
+
+    def retrieve(self, request, *args, **kwargs):
+        return cache.cached_response(request, cache.user_namespace(request.user.pk), lambda: super(
+            UserProfileView, self).retrieve(request, *args, **kwargs))
+
+
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    serializer_class = JobSerializer
+    permission_classes = [IsAuthenticated]
+    cursor_ordering = ('-id',)
+
+    def get_queryset(self):
+        return Job.objects.filter(user=self.request.user)
+
+
+class UserStatsView(generics.ListAPIView):
+    serializer_class = UserStatSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    cursor_ordering = ('-period_start',)
+
+    def get_queryset(self):
+        period = self.request.query_params.get('period', 'week')
+        if period not in PERIODS:
+            raise ValidationError({'period': f'Must be one of: {", ".join(PERIODS)}.'})
+        return UserStat.objects.filter(user=self.request.user, period=period)
+
+
+class LeaderboardView(generics.GenericAPIView):
+    serializer_class = LeaderboardSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        params = request.query_params
+        period = params.get('period', 'week')
+        metric = params.get('metric', 'distance')
+        if period not in PERIODS:
+            raise ValidationError({'period': f'Must be one of: {", ".join(PERIODS)}.'})
+        if metric not in METRICS:
+            raise ValidationError({'metric': f'Must be one of: {", ".join(METRICS)}.'})
+
+        try:
+            day = date.fromisoformat(params['date']) if 'date' in params else timezone.localdate()
+            limit = min(max(int(params.get('limit', 10)), 1), 100)
+        except ValueError:
+            raise ValidationError({'detail': 'date must be YYYY-MM-DD and limit a number.'})
+
+        start = period_start(period, day)
+        rows = (
+            UserStat.objects.filter(period=period, period_start=start)
+            .select_related('user')
+            .order_by(f'-{metric}', 'user_id')[:limit]
+        )
+        serializer = self.get_serializer(rows, many=True)
+        return Response({
+            'period': period,
+            'period_start': start,
+            'metric': metric,
+            'results': [{'rank': rank, **row} for rank, row in enumerate(serializer.data, start=1)],
+        })
+
+
+class HeatmapView(generics.GenericAPIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, z, x, y):
+        if z > 20 or x >= 2 ** z or y >= 2 ** z:
+            return Response({"error": "No such tile"}, status=404)
+
+        # Personal heatmaps show where someone runs (and lives), so only your own
+        user = request.query_params.get('user')
+        if user == 'me':
+            user = request.user.pk
+        elif user is not None:
+            if not user.isdigit():
+                raise ValidationError({'user': 'Must be a user id or "me".'})
+            if int(user) != request.user.pk:
+                raise PermissionDenied("You can only see your own heatmap.")
+            user = int(user)
+
+        try:
+            data = tile(z, x, y, user_id=user)
+        except ValueError as exc:
+            raise ValidationError({'z': str(exc)})
+        return Response({'z': z, 'x': x, 'y': y, **data})
+
+
+class SyncView(generics.GenericAPIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        # ?bbox=min_lat,min_lon,max_lat,max_lon limits the territories; keep it the same
+        # for every call with a token, or sync again without one
+        since = request.query_params.get('since')
+        bbox = request.query_params.get('bbox')
+        bbox = parse_coords(bbox, 4, 'bbox') if bbox else None
+        try:
+            positions = decode_token(since) if since else None
+        except ValueError:
+            raise ValidationError({'since': 'Invalid sync token, sync again without it.'})
+        data = changes(request.user, positions, bbox)
+
+        return Response({
+            'token': data['token'],
+            'has_more': data['has_more'],
+            'runs': RunSerializer(data['runs'], many=True).data,
+            'territories': TerritorySerializer(data['territories'], many=True).data,
+            'profile': UserSerializer(data['profile']).data if data['profile'] else None,
+            'deleted': data['deleted'],
+        })
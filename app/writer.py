@@ -0,0 +1,113 @@
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from app.models import Run
+
+logger = logging.getLogger(__name__)
+
+
+class LocationWriter:
+    """
+    Write-behind buffer for single-point uploads.
+
+    add_location only appends to an in-process buffer; a background thread writes the
+    buffer every LOCATION_WRITER_FLUSH_SECONDS, or as soon as LOCATION_WRITER_FLUSH_POINTS
+    points are waiting, through Run.add_points with one transaction per run. That turns
+    one SQLite write transaction per point into one per run and flush. A run whose points
+    fail to write LOCATION_WRITER_MAX_ATTEMPTS times in a row is logged and dropped. The
+    buffer is flushed at interpreter exit and from the gunicorn worker_exit hook
+    (gunicorn.conf.py). Each worker has its own buffer, so finish delays its job by
+    LOCATION_WRITER_FINISH_WAIT to let the other workers' flushes land first.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.size = 0
+        self.failures = {}
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def add(self, run_id, point):
+        with self.lock:
+            self.pending.setdefault(run_id, []).append(point)
+            self.size += 1
+            full = self.size >= settings.LOCATION_WRITER_FLUSH_POINTS
+            if self.thread is None:
+                self._start()
+        if full:
+            self.wakeup.set()
+
+    def _start(self):
+        self.thread = threading.Thread(target=self._loop, name='location-writer', daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def _loop(self):
+        while True:
+            self.wakeup.wait(settings.LOCATION_WRITER_FLUSH_SECONDS)
+            self.wakeup.clear()
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Location writer flush failed, points kept for the next attempt")
+                time.sleep(settings.LOCATION_WRITER_FLUSH_SECONDS)
+
+    def take(self, run_id=None):
+        with self.lock:
+            if run_id is None:
+                batch, self.pending = self.pending, {}
+            else:
+                points = self.pending.pop(run_id, None)
+                batch = {run_id: points} if points else {}
+            self.size -= sum(len(points) for points in batch.values())
+        return batch
+
+    def flush(self, run_id=None):
+        batch = self.take(run_id)
+        if not batch:
+            return 0
+
+        try:
+            runs = list(Run.objects.filter(id__in=batch))
+        except Exception:
+            self.put_back(batch)
+            raise
+
+        # One transaction per run, so a run whose points can't be written doesn't hold
+        # back everyone else's
+        written = 0
+        for run in runs:
+            points = batch[run.id]
+            try:
+                run.add_points(points)
+            except Exception:
+                self.failed(run.id, points)
+                continue
+            self.failures.pop(run.id, None)
+            written += len(points)
+        return written
+
+    def put_back(self, batch):
+        # add_points skips any points that did get stored, so putting back is always safe
+        with self.lock:
+            for key, points in batch.items():
+                self.pending[key] = points + self.pending.get(key, [])
+                self.size += len(points)
+
+    def failed(self, run_id, points):
+        attempts = self.failures.pop(run_id, 0) + 1
+        if attempts >= settings.LOCATION_WRITER_MAX_ATTEMPTS:
+            logger.exception("Dropped %d points of run %s after %d failed writes", len(points), run_id, attempts)
+            return
+        logger.exception("Writing %d points of run %s failed, kept for the next flush", len(points), run_id)
+        self.failures[run_id] = attempts
+        self.put_back({run_id: points})
+
+writer = LocationWriter()
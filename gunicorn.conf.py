@@ -0,0 +1,16 @@
+# Picked up automatically by gunicorn from the working directory
+
+
+def post_worker_init(worker):
+    # Every worker takes part in running background jobs
+    from app.jobs import runner
+    runner.start()
+
+
+def worker_exit(server, worker):
+    # Write any points still buffered by the location writer before the worker goes away,
+    # and let the jobs in hand finish
+    from app.jobs import runner
+    from app.writer import writer
+    writer.flush()
+    runner.stop()